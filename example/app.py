@@ -145,6 +145,9 @@ with st.sidebar:
 
 
 # Chat message handling
+# Only the most recent messages are kept and rendered so reruns stay cheap
+MAX_MESSAGES = 50
+
 if "messages" not in st.session_state:
     st.session_state["messages"] = []
 
@@ -218,8 +221,18 @@ if user_prompt and st.session_state["vectara_api_key"]:
             {"role": "assistant", "content": first_response}
         )
 
+# Drop messages beyond the window, keeping widget keys stable across reruns
+if "dropped_messages" not in st.session_state:
+    st.session_state["dropped_messages"] = 0
+overflow = len(st.session_state.messages) - MAX_MESSAGES
+if overflow > 0:
+    del st.session_state.messages[:overflow]
+    st.session_state["dropped_messages"] += overflow
+
 # Display chat messages
-for idx, msg in enumerate(st.session_state.messages):
+if st.session_state["dropped_messages"]:
+    st.caption(f"{st.session_state['dropped_messages']} earlier messages not shown")
+for idx, msg in enumerate(st.session_state.messages, start=st.session_state["dropped_messages"]):
     message(msg["content"], is_user=msg["role"] == "user", key=f"chat_message_{idx}")
 
 
@@ -1,5 +1,6 @@
 import os
 import requests
+import hashlib
 import http.client
 import json
 import logging
@@ -46,14 +47,95 @@ def create_corpus(api_key , customer_id ,corpus_name,corpus_description):
     return corpus_number, success_message
 
 
+# Persisted {sha256: [name, mtime, size]} of the files saved in a directory
+HASH_INDEX = ".hashes.json"
+
+
+def _sha256(path):
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+      for block in iter(lambda: f.read(1024 * 1024), b""):
+          digest.update(block)
+  return digest.hexdigest()
+
+
+def _load_hash_index(directory):
+  """Returns the persisted {sha256: [name, mtime, size]} index of `directory`.
+
+  Built once by hashing the existing files when the index is missing.
+  """
+  index_path = os.path.join(directory, HASH_INDEX)
+  if os.path.exists(index_path):
+      with open(index_path, encoding="utf-8") as f:
+          return json.load(f)
+  index = {}
+  for name in os.listdir(directory):
+      path = os.path.join(directory, name)
+      if not name.startswith(".") and os.path.isfile(path):
+          _record_hash(index, path, _sha256(path))
+  return index
+
+
+def _record_hash(index, path, digest):
+  stat = os.stat(path)
+  index[digest] = [os.path.basename(path), stat.st_mtime, stat.st_size]
+
+
+def _save_hash_index(directory, index):
+  index_path = os.path.join(directory, HASH_INDEX)
+  with open(f"{index_path}.tmp", "w", encoding="utf-8") as f:
+      json.dump(index, f)
+  os.replace(f"{index_path}.tmp", index_path)
+
+
+def _find_identical(directory, index, digest):
+  """Returns the path of a file in `directory` with the given SHA-256, if any.
+
+  Looked up in the hash index. The file is only re-hashed if it changed since
+  it was recorded.
+  """
+  entry = index.get(digest)
+  if entry is None:
+      return None
+  name, mtime, size = entry
+  path = os.path.join(directory, name)
+  try:
+      stat = os.stat(path)
+  except FileNotFoundError:
+      del index[digest]
+      return None
+  if (stat.st_mtime, stat.st_size) == (mtime, size) or _sha256(path) == digest:
+      return path
+  del index[digest]
+  return None
+
+
 def save_to_dir(uploaded_file):
   if uploaded_file is not None:
       temp_dir = "temp"
       os.makedirs(temp_dir, exist_ok=True)
-      file_path = os.path.join(temp_dir, uploaded_file.name)
 
-      with open(file_path, "wb") as f:
-          f.write(uploaded_file.getbuffer())
+      # Stream to a hidden partial file in chunks, hashing as we go
+      partial_path = os.path.join(temp_dir, f".{uploaded_file.name}.part")
+      digest = hashlib.sha256()
+      uploaded_file.seek(0)
+      with open(partial_path, "wb") as f:
+          for block in iter(lambda: uploaded_file.read(1024 * 1024), b""):
+              digest.update(block)
+              f.write(block)
+
+      # Skip re-scans and re-exports that were already saved under any name
+      index = _load_hash_index(temp_dir)
+      existing_path = _find_identical(temp_dir, index, digest.hexdigest())
+      if existing_path is not None:
+          os.remove(partial_path)
+          logging.info("Skipping duplicate upload %s, already saved as %s", uploaded_file.name, existing_path)
+          return existing_path
+
+      file_path = os.path.join(temp_dir, uploaded_file.name)
+      os.replace(partial_path, file_path)
+      _record_hash(index, file_path, digest.hexdigest())
+      _save_hash_index(temp_dir, index)
 
       return file_path
   
@@ -3,7 +3,11 @@ import os
 import logging
 import requests
 import streamlit as st
-from helpers import save_to_dir, get_jwt_token, upload_files_in_directory, query_corpus, get_report_summary
+from helpers import HEDGE_QUERIES, query_hedger, save_to_store, find_duplicate, get_jwt_token, index_document, query_corpus, get_report_summary
+from docstore import get_store
+from digests import lookup_patient_digest
+from labs import answer_numeric_query
+from chat_history import get_chat_history, render_chat_history
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -104,37 +108,53 @@ if selected_feature == "Patient Records Chat":
 
         st.write(f"Utilizing Model: {selected_model_value}")
 
+        if HEDGE_QUERIES:
+            hedging = query_hedger.report()
+            st.sidebar.caption(
+                f"Hedged queries: {hedging['hedges_fired']} fired, "
+                f"{hedging['hedges_won']} won of {hedging['requests']}"
+            )
+
         # Initialize chat history
-        if "messages" not in st.session_state:
-            st.session_state.messages = []
+        history = get_chat_history()
 
-        # Display chat messages from history on app rerun
-        for message in st.session_state.messages:
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
+        # Display the recent window (and one page of older turns) on app rerun
+        render_chat_history(history)
 
         # React to user input
         if prompt := st.chat_input("Input your query"):
             # Display user message in chat message container
             st.chat_message("user").markdown(prompt)
             # Add user message to chat history
-            st.session_state.messages.append({"role": "user", "content": prompt})
-
-            results, summary, score, documents = query_corpus(
-                CUSTOMER_ID, 
-                CORPUS_ID, 
-                IDX_ADDRESS, 
-                get_jwt_token(), 
-                prompt,
-                model=selected_model_value,
-                language=selected_language_initial,
-            )
-            response = f"SimpliMedi-Search: {summary}\n\nFactual Consistency Score: {score}"
+            history.append("user", prompt)
+
+            # Patient summaries and numeric questions are answered from the
+            # digests and lab index built at ingest
+            answer = lookup_patient_digest(prompt) or answer_numeric_query(prompt)
+            if answer is not None:
+                response = f"SimpliMedi-Search: {answer}"
+            else:
+                result = query_corpus(
+                    CUSTOMER_ID, 
+                    CORPUS_ID, 
+                    IDX_ADDRESS, 
+                    get_jwt_token(), 
+                    prompt,
+                    model=selected_model_value,
+                    language=selected_language_initial,
+                )
+                if result[-1] is False:
+                    response = "SimpliMedi-Search is busy right now, please try again in a moment."
+                else:
+                    results, summary, score, documents = result
+                    # Lets the document preview jump to pages with these passages
+                    st.session_state.last_results = results
+                    response = f"SimpliMedi-Search: {summary}\n\nFactual Consistency Score: {score}"
             # Display assistant response in chat message container
             with st.chat_message("assistant"):
                 st.markdown(response)
             # Add assistant response to chat history
-            st.session_state.messages.append({"role": "assistant", "content": response})
+            history.append("assistant", response)
 
 
 elif selected_feature == "Upload new document":
@@ -145,20 +165,32 @@ elif selected_feature == "Upload new document":
     )
 
     if uploaded_file is not None:
-        file_path = save_to_dir(uploaded_file)
-
-        # Upload the file to vectara server
-        upload_msg = upload_files_in_directory(
-            customer_id=CUSTOMER_ID,
-            corpus_id=CORPUS_ID,
-            idx_address="api.vectara.io",
-            directory_path="corpus",
-        )
-
-        if upload_msg[0][1]:
-            st.success("File Uploaded Successfully")
+        duplicate = find_duplicate(uploaded_file)
+        if duplicate is not None:
+            st.info(f"This report is already indexed as {duplicate.name}, skipping upload")
         else:
-            st.warning("Something went wrong, try again")
+            content_hash = save_to_store(uploaded_file)
+
+            # Index only the uploaded file on the vectara server
+            response, success = index_document(
+                customer_id=CUSTOMER_ID,
+                corpus_id=CORPUS_ID,
+                idx_address="api.vectara.io",
+                jwt_token=get_jwt_token(),
+                file_path=get_store().path(content_hash),
+                filename=uploaded_file.name,
+            )
+
+            if success:
+                st.success("File Uploaded Successfully")
+                stats = response.get("indexing_stats") if isinstance(response, dict) else None
+                if stats:
+                    st.caption(
+                        f"Sent {stats['payload_bytes']:,} bytes as {stats['chunks']} chunks "
+                        f"instead of the {stats['file_bytes']:,} byte file"
+                    )
+            else:
+                st.warning("Something went wrong, try again")
 
         get_report_summary(uploaded_file)
 
@@ -0,0 +1,100 @@
+"""Bounded chat history for Streamlit sessions.
+
+The last `window` messages are kept verbatim. Older messages are compacted
+(truncated) into an archive that is rendered one page at a time, and once the
+archive is full the oldest turns are folded into a short running summary. Both
+memory per session and the work done on each rerun stay bounded regardless of
+how long the session runs.
+"""
+import os
+import sys
+
+import streamlit as st
+
+CHAT_HISTORY_WINDOW = int(os.environ.get("CHAT_HISTORY_WINDOW", 20))
+CHAT_HISTORY_MAX_ARCHIVED = int(os.environ.get("CHAT_HISTORY_MAX_ARCHIVED", 200))
+COMPACT_CHARS = 280
+SUMMARY_TOPICS = 20
+
+
+def _compact(message):
+    content = message["content"]
+    if len(content) > COMPACT_CHARS:
+        content = content[:COMPACT_CHARS].rstrip() + "…"
+    return {"role": message["role"], "content": content}
+
+
+class ChatHistory:
+    """Chat messages with a verbatim window, a compacted archive and a summary."""
+
+    def __init__(self, window: int = CHAT_HISTORY_WINDOW, max_archived: int = CHAT_HISTORY_MAX_ARCHIVED):
+        self.window = window
+        self.max_archived = max_archived
+        self.recent = []
+        self.archive = []
+        self.summarized_count = 0
+        self.topics = []
+
+    def append(self, role: str, content: str):
+        self.recent.append({"role": role, "content": content})
+        while len(self.recent) > self.window:
+            self.archive.append(_compact(self.recent.pop(0)))
+        while len(self.archive) > self.max_archived:
+            self._summarize(self.archive.pop(0))
+
+    def _summarize(self, message):
+        self.summarized_count += 1
+        if message["role"] == "user":
+            self.topics.append(message["content"][:80])
+            del self.topics[:-SUMMARY_TOPICS]
+
+    @property
+    def summary(self):
+        """A one-paragraph summary of the turns dropped from the archive, or ''."""
+        if not self.summarized_count:
+            return ""
+        topics = "; ".join(self.topics)
+        return f"{self.summarized_count} earlier messages. Recent topics: {topics}"
+
+    def __len__(self):
+        return self.summarized_count + len(self.archive) + len(self.recent)
+
+    def archive_page(self, page: int, page_size: int):
+        """Returns archived messages for a 1-based page, newest page first."""
+        end = len(self.archive) - (page - 1) * page_size
+        return self.archive[max(0, end - page_size) : max(0, end)]
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by this history in bytes."""
+        messages = self.recent + self.archive
+        return (
+            sum(sys.getsizeof(m) + sys.getsizeof(m["content"]) for m in messages)
+            + sum(sys.getsizeof(t) for t in self.topics)
+        )
+
+
+def get_chat_history(key: str = "chat_history") -> ChatHistory:
+    """Returns the `ChatHistory` of the current Streamlit session."""
+    if key not in st.session_state:
+        st.session_state[key] = ChatHistory()
+    return st.session_state[key]
+
+
+def render_chat_history(history: ChatHistory, page_size: int = 10):
+    """Renders the summary, one page of the archive and the recent window."""
+    if history.summary or history.archive:
+        with st.expander(f"Earlier messages ({len(history) - len(history.recent)})"):
+            if history.summary:
+                st.caption(history.summary)
+            if history.archive:
+                pages = (len(history.archive) + page_size - 1) // page_size
+                page = st.number_input("Page", min_value=1, max_value=pages, value=1)
+                for message in history.archive_page(page, page_size):
+                    with st.chat_message(message["role"]):
+                        st.markdown(message["content"])
+
+    for message in history.recent:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+    st.sidebar.caption(f"Chat history: {len(history)} messages, {history.memory_bytes() / 1024:.1f} KB")
@@ -0,0 +1,135 @@
+import os
+import re
+import json
+
+import PyPDF2
+from docx import Document
+
+# Lines such as "Medical History:" or "Treatment Plan:" start a new section.
+SECTION_HEADING = re.compile(r"^\s*([A-Z][A-Za-z'/&,\- ]{2,60}):\s*$")
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[A-Z•])|\n+")
+PATIENT_FILENAME = re.compile(
+    r"^(?:(?:Mrs|Mr|Ms|Dr)\.?\s+)?(?P<name>.+?)\s+(?:Sunrise Health Medical Center|Medical Report)\b",
+    re.IGNORECASE,
+)
+
+MAX_CHUNK_CHARS = 1200
+
+
+def patient_from_filename(filename: str):
+    """Returns the patient name encoded in a report filename, or None.
+
+    Reports follow "<Name> Sunrise Health Medical Center.pdf" (or
+    "<Name> Medical Report.pdf").
+    """
+    match = PATIENT_FILENAME.match(os.path.splitext(os.path.basename(filename))[0])
+    return match.group("name").strip() if match else None
+
+
+def extract_pages(file_path: str):
+    """Extracts the text of a PDF, DOCX or TXT file, one string per page.
+
+    DOCX and TXT files are returned as a single page.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".pdf":
+        pdf_reader = PyPDF2.PdfReader(file_path)
+        return [page.extract_text() or "" for page in pdf_reader.pages]
+    elif extension == ".docx":
+        return ["".join(paragraph.text + "\n" for paragraph in Document(file_path).paragraphs)]
+    elif extension == ".txt":
+        with open(file_path, encoding="utf-8") as f:
+            return [f.read()]
+    return []
+
+
+def split_sections(text):
+    """Yields (section, text) pairs using heading lines as boundaries."""
+    section, lines = None, []
+    for line in text.splitlines():
+        match = SECTION_HEADING.match(line)
+        if match:
+            if any(l.strip() for l in lines):
+                yield section, "\n".join(lines)
+            section, lines = match.group(1).strip(), []
+        else:
+            lines.append(line)
+    if any(l.strip() for l in lines):
+        yield section, "\n".join(lines)
+
+
+def _pack_sentences(text, max_chars):
+    """Packs sentences into chunks of at most `max_chars` characters."""
+    chunk = ""
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        sentence = " ".join(sentence.split())
+        if not sentence:
+            continue
+        if chunk and len(chunk) + len(sentence) + 1 > max_chars:
+            yield chunk
+            chunk = ""
+        chunk = f"{chunk} {sentence}" if chunk else sentence
+    if chunk:
+        yield chunk
+
+
+def chunk_pages(pages, max_chars: int = MAX_CHUNK_CHARS):
+    """Splits page texts into section- and sentence-aware chunks.
+
+    Chunks never cross a section heading and only break between sentences or
+    lines. The last heading seen carries over to the following page.
+
+    Returns:
+        A list of dicts with "text", "page" (1-based) and "section" keys.
+    """
+    chunks = []
+    current_section = None
+    for page_number, page_text in enumerate(pages, start=1):
+        for section, text in split_sections(page_text):
+            current_section = section or current_section
+            for chunk in _pack_sentences(text, max_chars):
+                chunks.append({"text": chunk, "page": page_number, "section": current_section})
+    return chunks
+
+
+def build_core_document(
+    file_path: str, pages=None, max_chars: int = MAX_CHUNK_CHARS, filename: str = None
+):
+    """Builds a Vectara core document (one part per chunk) for a local file.
+
+    Args:
+        file_path: Path of the report.
+        pages: Already extracted page texts, extracted from `file_path` if omitted.
+        max_chars: Maximum number of characters per chunk.
+        filename: Name of the report, when `file_path` does not carry it (e.g. a
+            blob in the document store). Defaults to the basename of `file_path`.
+
+    Returns:
+        A dict ready to be sent as the "document" of a `/v1/core/index` request.
+    """
+    filename = filename or os.path.basename(file_path)
+    patient = patient_from_filename(filename)
+    pages = extract_pages(file_path) if pages is None else pages
+
+    doc_metadata = {"filename": filename}
+    if patient:
+        doc_metadata["patient"] = patient
+
+    parts = []
+    for chunk in chunk_pages(pages, max_chars):
+        part_metadata = {"page": chunk["page"]}
+        if chunk["section"]:
+            part_metadata["section"] = chunk["section"]
+        parts.append(
+            {
+                "text": chunk["text"],
+                "metadataJson": json.dumps(part_metadata, separators=(",", ":")),
+            }
+        )
+
+    return {
+        "documentId": filename,
+        "title": filename,
+        "metadataJson": json.dumps(doc_metadata, separators=(",", ":")),
+        "parts": parts,
+    }
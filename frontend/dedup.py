@@ -0,0 +1,248 @@
+"""Ingestion-time duplicate detection for the corpus.
+
+Exact duplicates are found by SHA-256 of the file content, near-duplicates
+(re-scans, re-exports) by MinHash signatures over word shingles of the
+extracted text. Signatures live in SQLite with LSH band buckets indexed, so a
+lookup only reads the handful of candidate signatures sharing a bucket.
+
+Backfill or audit an existing directory with:
+
+    python dedup.py corpus
+"""
+import os
+import re
+import sys
+import sqlite3
+import hashlib
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+DEDUP_DB = os.environ.get("DEDUP_DB", "dedup.sqlite3")
+NUM_PERM = 128
+BANDS = 16
+SHINGLE_SIZE = 5
+NEAR_DUPLICATE_THRESHOLD = 0.85
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+
+Duplicate = namedtuple("Duplicate", ["name", "kind", "similarity"])
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text: str):
+    """Returns the MinHash signature of `text` as a uint32 array, or None if it has no words."""
+    shingles = _shingles(text)
+    if not shingles:
+        return None
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    permuted = ((hashes[:, None] * _PERM_A + _PERM_B) % _MERSENNE_PRIME) & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def _band_buckets(signature):
+    rows = NUM_PERM // BANDS
+    return [
+        (band, int.from_bytes(hashlib.blake2b(signature[band * rows : (band + 1) * rows].tobytes(), digest_size=8).digest(), "little", signed=True))
+        for band in range(BANDS)
+    ]
+
+
+class DedupIndex:
+    """Persistent index of content hashes and MinHash signatures."""
+
+    def __init__(self, path: str = DEDUP_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
+                    sha256 TEXT NOT NULL,
+                    signature BLOB,
+                    duplicate_of INTEGER REFERENCES documents(id)
+                );
+                CREATE INDEX IF NOT EXISTS documents_sha256 ON documents(sha256);
+                CREATE TABLE IF NOT EXISTS lsh_buckets (
+                    band INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    doc_id INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS lsh_buckets_lookup ON lsh_buckets(band, bucket);
+                CREATE INDEX IF NOT EXISTS lsh_buckets_doc ON lsh_buckets(doc_id);
+                """
+            )
+
+    def find(self, data: bytes, text: str = "", signature=None):
+        """Returns the `Duplicate` that `data` matches, or None for a new document.
+
+        Args:
+            data: Raw file content, compared by SHA-256.
+            text: Extracted text, compared by MinHash when there is no exact match.
+            signature: Precomputed `minhash(text)`, computed when omitted.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT name FROM documents WHERE sha256 = ? AND duplicate_of IS NULL LIMIT 1",
+                (content_hash(data),),
+            ).fetchone()
+            if row:
+                return Duplicate(row[0], "exact", 1.0)
+
+            signature = minhash(text) if signature is None else signature
+            if signature is None:
+                return None
+            candidates = set()
+            for band, bucket in _band_buckets(signature):
+                candidates.update(
+                    doc_id
+                    for (doc_id,) in self._conn.execute(
+                        "SELECT doc_id FROM lsh_buckets WHERE band = ? AND bucket = ?",
+                        (band, bucket),
+                    )
+                )
+            best = None
+            for doc_id in candidates:
+                name, blob = self._conn.execute(
+                    "SELECT name, signature FROM documents WHERE id = ?", (doc_id,)
+                ).fetchone()
+                similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+                if similarity >= NEAR_DUPLICATE_THRESHOLD and (best is None or similarity > best.similarity):
+                    best = Duplicate(name, "near", similarity)
+            return best
+
+    def add(self, name: str, data: bytes, text: str = "", duplicate_of: str = None):
+        """Records a document, either as a new original or as a link to `duplicate_of`."""
+        sha256 = content_hash(data)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM lsh_buckets WHERE doc_id IN (SELECT id FROM documents WHERE name = ?)",
+                (name,),
+            )
+            # Upserts keep the row id, which copies reference in duplicate_of
+            if duplicate_of is not None:
+                self._conn.execute(
+                    "INSERT INTO documents (name, sha256, duplicate_of) "
+                    "VALUES (?, ?, (SELECT id FROM documents WHERE name = ?)) "
+                    "ON CONFLICT(name) DO UPDATE SET sha256 = excluded.sha256, "
+                    "signature = NULL, duplicate_of = excluded.duplicate_of",
+                    (name, sha256, duplicate_of),
+                )
+                return
+            signature = minhash(text)
+            self._conn.execute(
+                "INSERT INTO documents (name, sha256, signature) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET sha256 = excluded.sha256, "
+                "signature = excluded.signature, duplicate_of = NULL",
+                (name, sha256, signature.tobytes() if signature is not None else None),
+            )
+            (doc_id,) = self._conn.execute(
+                "SELECT id FROM documents WHERE name = ?", (name,)
+            ).fetchone()
+            if signature is not None:
+                self._conn.executemany(
+                    "INSERT INTO lsh_buckets (band, bucket, doc_id) VALUES (?, ?, ?)",
+                    [(band, bucket, doc_id) for band, bucket in _band_buckets(signature)],
+                )
+
+    def remove(self, name: str):
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id FROM documents WHERE name = ?", (name,)).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM lsh_buckets WHERE doc_id = ?", row)
+                self._conn.execute("UPDATE documents SET duplicate_of = NULL WHERE duplicate_of = ?", row)
+                self._conn.execute("DELETE FROM documents WHERE id = ?", row)
+
+    def check(self, name: str, data: bytes, text: str = ""):
+        """Looks up a document before it is indexed.
+
+        Duplicates of another document are recorded as links to it. New
+        documents and new revisions are not recorded: call `add` once they
+        are indexed, so a failed indexing attempt is not mistaken for an
+        indexed original on retry.
+
+        Returns:
+            The `Duplicate` found, or None if the document needs indexing.
+        """
+        duplicate = self.find(data, text)
+        if duplicate is not None and duplicate.name == name:
+            # An exact match on its own name is already indexed, while a near
+            # match is a new revision of the same document.
+            return duplicate if duplicate.kind == "exact" else None
+        if duplicate is not None:
+            self.add(name, data, text, duplicate_of=duplicate.name)
+        return duplicate
+
+    def check_and_add(self, name: str, data: bytes, text: str = ""):
+        """Looks up a document known to be indexed and records it.
+
+        Returns:
+            The `Duplicate` found, or None if the document is new.
+        """
+        duplicate = self.check(name, data, text)
+        if duplicate is None:
+            self.add(name, data, text)
+        return duplicate
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> DedupIndex:
+    """Returns the process-wide `DedupIndex` stored at DEDUP_DB."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DedupIndex()
+        return _index
+
+
+def index_directory(directory_path: str, index: DedupIndex = None):
+    """Adds every file of a directory to the index.
+
+    Returns:
+        A list of (file_name, Duplicate) for the files found to be duplicates.
+    """
+    from chunking import extract_pages
+
+    index = index or get_index()
+    duplicates = []
+    for file_name in sorted(os.listdir(directory_path)):
+        file_path = os.path.join(directory_path, file_name)
+        if not os.path.isfile(file_path):
+            continue
+        with open(file_path, "rb") as f:
+            data = f.read()
+        duplicate = index.check_and_add(file_name, data, "".join(extract_pages(file_path)))
+        if duplicate:
+            duplicates.append((file_name, duplicate))
+    return duplicates
+
+
+if __name__ == "__main__":
+    for directory in sys.argv[1:] or ["corpus"]:
+        for file_name, duplicate in index_directory(directory):
+            print(f"{directory}/{file_name}: {duplicate.kind} duplicate of {duplicate.name} ({duplicate.similarity:.2f})")
@@ -0,0 +1,221 @@
+"""Per-patient digests built at ingest time.
+
+Each indexed report contributes a short extract of its key sections (visit,
+diagnosis, treatment, follow-up) to a digest stored as JSON per patient. When a
+patient gets a new document only that document's entry is rebuilt. Chat
+questions like "summarize patient X" are answered from the stored digest
+instead of a retrieval and LLM round trip.
+
+Backfill digests for an existing directory with:
+
+    python digests.py corpus
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import contextlib
+from collections import defaultdict
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from chunking import extract_pages, patient_from_filename, split_sections
+
+DIGEST_DIR = os.environ.get("DIGEST_DIR", "digests")
+KEY_SECTIONS = (
+    "Current Medical Assessment",
+    "Medical History",
+    "Diagnosis",
+    "Treatment Plan",
+    "Prognosis",
+    "Follow-Up",
+)
+SECTION_CHARS = 400
+SUMMARY_INTENT = re.compile(
+    r"\b(summar\w*|overview|digest|brief\w*|tell me about)\b", re.IGNORECASE
+)
+
+_known = {"mtime": None, "patients": {}}
+_known_lock = threading.Lock()
+# Serializes the load -> modify -> write of each patient's digest between
+# threads; `_patient_lock` adds a lock file for other processes.
+_patient_locks = defaultdict(threading.Lock)
+_patient_locks_lock = threading.Lock()
+
+
+def _digest_path(patient):
+    slug = re.sub(r"[^a-z0-9]+", "_", patient.lower()).strip("_")
+    return os.path.join(DIGEST_DIR, f"{slug}.json")
+
+
+@contextlib.contextmanager
+def _patient_lock(patient):
+    """Locks one patient's digest against other threads and other processes."""
+    with _patient_locks_lock:
+        thread_lock = _patient_locks[patient]
+    os.makedirs(DIGEST_DIR, exist_ok=True)
+    with thread_lock, open(f"{_digest_path(patient)}.lock", "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _write_digest(path, digest):
+    os.makedirs(DIGEST_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=DIGEST_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(digest, f)
+    os.replace(tmp_path, path)
+
+
+def _compact(text, max_chars=SECTION_CHARS):
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars].rsplit(" ", 1)[0] + "…"
+
+
+def extract_key_sections(pages):
+    """Returns {section: compacted text} for the key sections of a report.
+
+    Falls back to the beginning of the report when none of KEY_SECTIONS is found.
+    """
+    sections = {}
+    for section, text in split_sections("\n".join(pages)):
+        if section is None:
+            continue
+        for key in KEY_SECTIONS:
+            if section.lower().startswith(key.lower()) and key not in sections:
+                sections[key] = _compact(text)
+    if not sections:
+        sections["Report"] = _compact("\n".join(pages), SECTION_CHARS * 2)
+    return sections
+
+
+def render_digest(digest):
+    """Renders a stored digest as markdown."""
+    lines = [f"**Patient digest: {digest['patient']}** ({len(digest['documents'])} documents)"]
+    for filename, entry in sorted(digest["documents"].items()):
+        lines.append(f"\n*{filename}*")
+        lines.extend(f"- **{section}**: {text}" for section, text in entry["sections"].items())
+    return "\n".join(lines)
+
+
+def load_digest(patient: str):
+    path = _digest_path(patient)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def update_patient_digest(file_path: str, pages=None, filename: str = None):
+    """Adds or refreshes one document in its patient's digest.
+
+    Args:
+        file_path: Path of the indexed report. The patient is taken from its name.
+        pages: Already extracted page texts, extracted from `file_path` if omitted.
+        filename: Name of the report when `file_path` does not carry it, e.g. a
+            blob in the document store.
+
+    Returns:
+        The updated digest, or None if the filename does not name a patient.
+    """
+    filename = filename or os.path.basename(file_path)
+    patient = patient_from_filename(filename)
+    if patient is None:
+        return None
+    with open(file_path, "rb") as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+
+    with _patient_lock(patient):
+        digest = load_digest(patient) or {"patient": patient, "documents": {}}
+        if digest["documents"].get(filename, {}).get("sha256") == sha256:
+            return digest
+
+        pages = extract_pages(file_path) if pages is None else pages
+        digest["documents"][filename] = {
+            "sha256": sha256,
+            "sections": extract_key_sections(pages),
+        }
+        digest["updated_at"] = time.time()
+        digest["markdown"] = render_digest(digest)
+        _write_digest(_digest_path(patient), digest)
+    return digest
+
+
+def remove_document(file_path: str):
+    """Removes a deleted document from its patient's digest."""
+    patient = patient_from_filename(file_path)
+    if patient is None:
+        return
+    with _patient_lock(patient):
+        digest = load_digest(patient)
+        if digest is None or digest["documents"].pop(os.path.basename(file_path), None) is None:
+            return
+        path = _digest_path(patient)
+        if not digest["documents"]:
+            os.remove(path)
+            return
+        digest["markdown"] = render_digest(digest)
+        _write_digest(path, digest)
+
+
+def _known_patients():
+    """Returns {lowercase name: patient} for every stored digest, cached by directory mtime."""
+    try:
+        mtime = os.stat(DIGEST_DIR).st_mtime
+    except FileNotFoundError:
+        return {}
+    with _known_lock:
+        if _known["mtime"] != mtime:
+            patients = {}
+            for name in os.listdir(DIGEST_DIR):
+                if name.endswith(".json"):
+                    with open(os.path.join(DIGEST_DIR, name), encoding="utf-8") as f:
+                        patient = json.load(f)["patient"]
+                    patients[patient.lower()] = patient
+            _known.update(mtime=mtime, patients=patients)
+        return _known["patients"]
+
+
+def lookup_patient_digest(query: str):
+    """Answers patient-summary questions from the precomputed digests.
+
+    Returns:
+        The digest markdown if `query` asks for a summary of a known patient,
+        otherwise None so the caller falls back to `query_corpus`.
+    """
+    if not SUMMARY_INTENT.search(query):
+        return None
+    lowered = query.lower()
+    # Longest names first, so "Ann Lee" wins over a patient called "Lee"
+    for name, patient in sorted(_known_patients().items(), key=lambda item: -len(item[0])):
+        if re.search(rf"\b{re.escape(name)}\b", lowered):
+            digest = load_digest(patient)
+            return digest["markdown"] if digest else None
+    return None
+
+
+if __name__ == "__main__":
+    for directory in sys.argv[1:] or ["corpus"]:
+        for file_name in sorted(os.listdir(directory)):
+            file_path = os.path.join(directory, file_name)
+            if os.path.isfile(file_path) and update_patient_digest(file_path):
+                print(f"Updated digest for {patient_from_filename(file_name)}")
@@ -0,0 +1,183 @@
+"""Content-addressed document store.
+
+Uploads are streamed to disk in chunks while being hashed, then stored once
+under their SHA-256 (`blobs/ab/<sha256><ext>`), with a name -> hash index in
+SQLite. Identical uploads under different names share one blob, and a new
+upload under an existing name simply points the name at the new blob.
+
+Uploads are indexed straight from their blob (`DocumentStore.path`) with the
+upload name passed alongside, so each document exists on disk exactly once and
+the quota below accounts for all of it. Blobs are made read-only. The quota is
+enforced by evicting stale partial uploads and then unreferenced blobs, least
+recently used first.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+DOCSTORE_DIR = os.environ.get("DOCSTORE_DIR", "store")
+DOCSTORE_QUOTA_BYTES = int(os.environ.get("DOCSTORE_QUOTA_BYTES", 5 * 1024**3))
+CHUNK_SIZE = 1024 * 1024
+STALE_TEMP_SECONDS = 3600
+
+
+class DocumentStore:
+    """Stores each distinct document once under its content hash."""
+
+    def __init__(self, root: str = DOCSTORE_DIR, quota_bytes: int = DOCSTORE_QUOTA_BYTES):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.blob_dir = os.path.join(root, "blobs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    ext TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs(last_access);
+                CREATE TABLE IF NOT EXISTS names (
+                    name TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL REFERENCES blobs(sha256)
+                );
+                CREATE INDEX IF NOT EXISTS names_sha256 ON names(sha256);
+                """
+            )
+
+    def _blob_path(self, sha256, ext):
+        return os.path.join(self.blob_dir, sha256[:2], f"{sha256}{ext}")
+
+    def put(self, name: str, stream, chunk_size: int = CHUNK_SIZE) -> str:
+        """Streams a file-like object into the store under `name`.
+
+        The content is written to a temporary file in `chunk_size` pieces while
+        it is hashed, so the upload is never held twice in memory.
+
+        Returns:
+            The SHA-256 of the content.
+        """
+        if hasattr(stream, "seek"):
+            stream.seek(0)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: stream.read(chunk_size), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+            ext = os.path.splitext(name)[1].lower()
+
+            with self._lock, self._conn:
+                row = self._conn.execute(
+                    "SELECT ext FROM blobs WHERE sha256 = ?", (sha256,)
+                ).fetchone()
+                if row is None or not os.path.exists(self._blob_path(sha256, row[0])):
+                    blob_path = self._blob_path(sha256, ext)
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    os.chmod(tmp_path, 0o444)
+                    os.replace(tmp_path, blob_path)
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)",
+                        (sha256, ext, size, time.time()),
+                    )
+                else:
+                    self._conn.execute(
+                        "UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), sha256)
+                    )
+                self._conn.execute("INSERT OR REPLACE INTO names VALUES (?, ?)", (name, sha256))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.enforce_quota()
+        return sha256
+
+    def resolve(self, name: str):
+        """Returns the content hash stored under `name`, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT sha256 FROM names WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def path(self, sha256: str) -> str:
+        """Returns the on-disk path of a blob, marking it as recently used."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT ext FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                raise KeyError(sha256)
+            self._conn.execute(
+                "UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), sha256)
+            )
+        return self._blob_path(sha256, row[0])
+
+    def remove_name(self, name: str):
+        """Drops a name. Its blob becomes eligible for eviction once unreferenced."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM names WHERE name = ?", (name,))
+
+    def _temp_files(self):
+        """Yields (path, stat) for temporary files, skipping ones concurrent puts just moved."""
+        for entry in os.scandir(self.tmp_dir):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            yield entry.path, stat
+
+    def usage_bytes(self) -> int:
+        with self._lock:
+            blobs = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        return blobs + sum(stat.st_size for _, stat in self._temp_files())
+
+    def enforce_quota(self):
+        """Evicts stale temporary files, then unreferenced blobs (LRU), until under quota."""
+        now = time.time()
+        for path, stat in self._temp_files():
+            if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+        excess = self.usage_bytes() - self.quota_bytes
+        if excess <= 0:
+            return
+        with self._lock, self._conn:
+            unreferenced = self._conn.execute(
+                "SELECT sha256, ext, size FROM blobs "
+                "WHERE sha256 NOT IN (SELECT sha256 FROM names) ORDER BY last_access"
+            ).fetchall()
+            for sha256, ext, size in unreferenced:
+                if excess <= 0:
+                    break
+                blob_path = self._blob_path(sha256, ext)
+                if os.path.exists(blob_path):
+                    os.remove(blob_path)
+                self._conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                excess -= size
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> DocumentStore:
+    """Returns the process-wide `DocumentStore` rooted at DOCSTORE_DIR."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DocumentStore()
+        return _store
@@ -0,0 +1,291 @@
+"""CPU embedding service with dynamic micro-batching and an embedding cache.
+
+Concurrent callers of `EmbeddingService.embed` are grouped into micro-batches
+(up to `max_batch_size` texts, waiting at most `max_wait_ms` for a batch to fill).
+Each batch is sorted by length so texts of similar size are padded together.
+Embeddings are cached by the SHA-256 of the text.
+
+Two backends are supported:
+    - sentence-transformers (default), using the pinned `sentence-transformers`.
+    - an int8-quantized ONNX export run with onnxruntime, usually 2-4x faster
+      on CPU. Export the model with `optimum-cli export onnx --model <name> <dir>`
+      and quantize it with `python embeddings.py quantize <dir>/model.onnx`.
+
+Bulk corpus embedding uses a multi-process pool (`embed_corpus`).
+
+Benchmark over the corpus with:
+
+    python embeddings.py bench corpus [--onnx <dir>]
+"""
+import os
+import sys
+import time
+import queue
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from resilience import ResultCache
+
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_ONNX_DIR = os.environ.get("EMBEDDING_ONNX_DIR")
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SentenceTransformerBackend:
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def encode(self, texts):
+        return self.model.encode(
+            texts, batch_size=len(texts), convert_to_numpy=True, normalize_embeddings=True
+        )
+
+
+class OnnxBackend:
+    """Runs an (optionally int8-quantized) ONNX export of the model with onnxruntime."""
+
+    def __init__(self, model_dir: str, model_file: str = None, intra_op_threads: int = 0):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        if model_file is None:
+            quantized = os.path.join(model_dir, "model_int8.onnx")
+            model_file = quantized if os.path.exists(quantized) else os.path.join(model_dir, "model.onnx")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # 0 lets onnxruntime use every core; pool workers pass 1
+        options.intra_op_num_threads = intra_op_threads
+        self.session = onnxruntime.InferenceSession(
+            model_file, options, providers=["CPUExecutionProvider"]
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts):
+        tokens = self.tokenizer(
+            list(texts), padding=True, truncation=True, max_length=256, return_tensors="np"
+        )
+        inputs = {k: v.astype(np.int64) for k, v in tokens.items() if k in self.input_names}
+        hidden = self.session.run(None, inputs)[0]
+        # Mean pooling over non-padding tokens, then L2 normalisation
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.linalg.norm(pooled, axis=1, keepdims=True)
+
+
+def quantize_onnx(model_file: str, output_file: str = None) -> str:
+    """Writes a dynamically int8-quantized copy of an ONNX model and returns its path."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output_file = output_file or os.path.join(os.path.dirname(model_file), "model_int8.onnx")
+    quantize_dynamic(model_file, output_file, weight_type=QuantType.QInt8)
+    return output_file
+
+
+def load_backend(
+    onnx_dir: str = EMBEDDING_ONNX_DIR, model_name: str = EMBEDDING_MODEL, threads: int = 0
+):
+    """Loads the ONNX backend if `onnx_dir` is set, sentence-transformers otherwise.
+
+    `threads` caps the intra-op threads of the backend, 0 meaning all cores.
+    """
+    if onnx_dir:
+        return OnnxBackend(onnx_dir, intra_op_threads=threads)
+    if threads:
+        import torch
+
+        torch.set_num_threads(threads)
+    return SentenceTransformerBackend(model_name)
+
+
+def _encode_sorted(backend, texts):
+    """Encodes texts in length order to minimise padding, returning them in input order."""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    encoded = backend.encode([texts[i] for i in order])
+    result = np.empty_like(encoded)
+    result[order] = encoded
+    return result
+
+
+class EmbeddingService:
+    """Thread-safe embedding front end that micro-batches requests across callers."""
+
+    def __init__(
+        self,
+        backend=None,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10.0,
+        cache_size: int = 100_000,
+    ):
+        self.backend = backend or load_backend()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache = ResultCache(max_entries=cache_size, ttl=float("inf"))
+        self.stats = {"texts": 0, "cache_hits": 0, "batches": 0}
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._batch_loop, daemon=True)
+        self._worker.start()
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.stats["batches"] += 1
+            try:
+                embeddings = _encode_sorted(self.backend, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (text, future), embedding in zip(batch, embeddings):
+                self.cache.put(text_hash(text), embedding)
+                future.set_result(embedding)
+
+    def embed(self, texts):
+        """Returns an (n, dim) array of normalised embeddings for `texts`."""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        futures = []
+        for text in texts:
+            self.stats["texts"] += 1
+            cached = self.cache.get(text_hash(text))
+            if cached is not None:
+                self.stats["cache_hits"] += 1
+                future = Future()
+                future.set_result(cached)
+            else:
+                future = Future()
+                self._queue.put((text, future))
+            futures.append(future)
+        return np.stack([future.result() for future in futures])
+
+
+_worker_backend = None
+
+
+def _init_worker(onnx_dir, model_name):
+    global _worker_backend
+    # One intra-op thread per process, the pool provides the parallelism
+    _worker_backend = load_backend(onnx_dir, model_name, threads=1)
+
+
+def _encode_chunk(texts):
+    return _encode_sorted(_worker_backend, texts)
+
+
+def embed_corpus(
+    texts,
+    processes: int = None,
+    batch_size: int = 64,
+    onnx_dir: str = EMBEDDING_ONNX_DIR,
+    model_name: str = EMBEDDING_MODEL,
+    cache: ResultCache = None,
+):
+    """Embeds a large list of texts with a pool of worker processes.
+
+    Texts are sorted by length before being split into batches so each batch
+    pads to a similar length. Texts already in `cache` are not re-embedded.
+    """
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    keys = [text_hash(text) for text in texts]
+    embeddings = [cache.get(key) if cache is not None else None for key in keys]
+    missing = sorted((i for i, e in enumerate(embeddings) if e is None), key=lambda i: len(texts[i]))
+    batches = [missing[i : i + batch_size] for i in range(0, len(missing), batch_size)]
+
+    if batches:
+        # Spawned rather than forked: the parent may hold model threads
+        with multiprocessing.get_context("spawn").Pool(
+            processes or os.cpu_count(), initializer=_init_worker, initargs=(onnx_dir, model_name)
+        ) as pool:
+            results = pool.map(_encode_chunk, [[texts[i] for i in batch] for batch in batches])
+        for batch, encoded in zip(batches, results):
+            for i, embedding in zip(batch, encoded):
+                embeddings[i] = embedding
+                if cache is not None:
+                    cache.put(keys[i], embedding)
+    return np.stack(embeddings)
+
+
+def _corpus_texts(directory):
+    from chunking import chunk_pages, extract_pages
+
+    texts = []
+    for file_name in sorted(os.listdir(directory)):
+        file_path = os.path.join(directory, file_name)
+        if os.path.isfile(file_path):
+            texts.extend(chunk["text"] for chunk in chunk_pages(extract_pages(file_path)))
+    return texts
+
+
+def benchmark(directory: str, onnx_dir: str = None, processes: int = None, concurrency: int = 16):
+    """Prints single-request latency and bulk throughput over a corpus directory."""
+    texts = _corpus_texts(directory)
+    print(f"{len(texts)} chunks from {directory}, backend: {'onnx ' + onnx_dir if onnx_dir else EMBEDDING_MODEL}")
+
+    service = EmbeddingService(load_backend(onnx_dir))
+    latencies = []
+
+    def one(text):
+        start = time.monotonic()
+        service.embed([text])
+        latencies.append(time.monotonic() - start)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, texts))
+    elapsed = time.monotonic() - start
+    latencies.sort()
+    print(
+        f"micro-batched ({concurrency} callers): {len(texts) / elapsed:.1f} docs/s, "
+        f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+        f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, "
+        f"{service.stats['batches']} batches"
+    )
+
+    start = time.monotonic()
+    service.embed(texts)
+    print(f"cached: {len(texts) / (time.monotonic() - start):.0f} docs/s")
+
+    start = time.monotonic()
+    embed_corpus(texts, processes=processes, onnx_dir=onnx_dir)
+    print(f"bulk ({processes or os.cpu_count()} processes): {len(texts) / (time.monotonic() - start):.1f} docs/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding service tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench = subparsers.add_parser("bench", help="Benchmark embedding over a corpus directory")
+    bench.add_argument("directory", nargs="?", default="corpus")
+    bench.add_argument("--onnx", default=EMBEDDING_ONNX_DIR)
+    bench.add_argument("--processes", type=int)
+    quantize = subparsers.add_parser("quantize", help="Quantize an ONNX model to int8")
+    quantize.add_argument("model_file")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        benchmark(args.directory, args.onnx, args.processes)
+    else:
+        print(quantize_onnx(args.model_file))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
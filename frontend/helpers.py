@@ -1,14 +1,23 @@
 import json
 import os
+import time
 import logging
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import PyPDF2
 from docx import Document
 from together import Together
-from streamlit_pdf_viewer import pdf_viewer
-from openai import OpenAI
+from openai import APIError, OpenAI
 from dotenv import load_dotenv
+from resilience import CircuitOpenError, Hedger, SharedCache, call_upstream, get_upstream
+from chunking import build_core_document, extract_pages
+from dedup import get_index
+from preview import render_pdf_preview
+from digests import remove_document as remove_from_digest, update_patient_digest
+from labs import get_index as get_lab_index
+from docstore import get_store
 
 
 load_dotenv()
@@ -62,33 +71,97 @@ models = {
     "GPT-4-Turbo": "vectara-summary-ext-v1.3.0",
 }
 
+# Pooled HTTP session shared by every caller in the process (Streamlit sessions
+# and the headless search service), so TLS connections to Vectara are reused.
+session = requests.Session()
+session.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=32)
+)
+session.mount(
+    "http://", requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=32)
+)
+
+# Per-request timeout for /v1/query, and opt-in hedging of slow queries: a
+# duplicate is sent once the first attempt passes the p95 latency, for at most
+# ~10% of requests.
+QUERY_TIMEOUT = float(os.environ.get("QUERY_TIMEOUT", 30))
+HEDGE_QUERIES = os.environ.get("HEDGE_QUERIES", "").lower() in ("1", "true", "yes")
+query_hedger = Hedger(
+    percentile=float(os.environ.get("HEDGE_PERCENTILE", 95)),
+    budget=float(os.environ.get("HEDGE_BUDGET", 0.1)),
+)
+
+# Cached JWT token, refreshed shortly before it expires. The shared cache lets
+# other processes (service workers, the sync daemon) reuse the same token.
+_token_cache = {"token": None, "expires_at": 0.0}
+_token_lock = threading.Lock()
+_shared_tokens = SharedCache("jwt")
+TOKEN_REFRESH_MARGIN = 60
+
+
+def _base_url(address: str) -> str:
+    """Returns the base URL for a server address, defaulting to https.
+
+    Addresses that already carry a scheme (e.g. http://127.0.0.1:8081 for the
+    local mock upstream) are used as-is.
+    """
+    if address.startswith(("http://", "https://")):
+        return address.rstrip("/")
+    return f"https://{address}"
 
-def get_jwt_token():
-    """Get JWT token from authentication service."""
-    auth_url = AUTH_URL
-    client_id = APP_CLIENT_ID
-    client_secret = APP_CLIENT_SECRET
-
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": client_id,
-        "client_secret": client_secret,
-    }
-
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
-    response = requests.post(auth_url, headers=headers, data=data)
+def get_jwt_token():
+    """Get JWT token from authentication service.
 
-    if response.status_code == 200:
-        response_data = response.json()
-        return response_data.get("access_token")
-    else:
-        print("Error:", response.text)
-        return None
+    The token is cached and shared across callers and processes until shortly
+    before it expires.
+    """
+    with _token_lock:
+        if _token_cache["token"] and time.time() < _token_cache["expires_at"]:
+            return _token_cache["token"]
+        shared = _shared_tokens.get((AUTH_URL, APP_CLIENT_ID))
+        if shared is not None:
+            _token_cache.update(shared)
+            return _token_cache["token"]
+
+        auth_url = AUTH_URL
+        client_id = APP_CLIENT_ID
+        client_secret = APP_CLIENT_SECRET
+
+        data = {
+            "grant_type": "client_credentials",
+            "client_id": client_id,
+            "client_secret": client_secret,
+        }
+
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+        response = session.post(auth_url, headers=headers, data=data)
+
+        if response.status_code == 200:
+            response_data = response.json()
+            _token_cache["token"] = response_data.get("access_token")
+            _token_cache["expires_at"] = (
+                time.time() + response_data.get("expires_in", 3600) - TOKEN_REFRESH_MARGIN
+            )
+            _shared_tokens.put(
+                (AUTH_URL, APP_CLIENT_ID),
+                dict(_token_cache),
+                _token_cache["expires_at"] - time.time(),
+            )
+            return _token_cache["token"]
+        else:
+            print("Error:", response.text)
+            return None
 
 
 def upload_file(
-    customer_id: int, corpus_id: int, idx_address: str, jwt_token: str, file_path: str
+    customer_id: int,
+    corpus_id: int,
+    idx_address: str,
+    jwt_token: str,
+    file_path: str,
+    filename: str = None,
 ):
     """Uploads a file to the corpus.
 
@@ -98,19 +171,20 @@ def upload_file(
         idx_address: Address of the indexing server. e.g., api.vectara.io
         jwt_token: A valid Auth token.
         file_path: Path to the file to be uploaded.
+        filename: Name to index the file under. Defaults to the basename of `file_path`.
 
     Returns:
         (response, True) in case of success and returns (error, False) in case of failure.
     """
 
     # Extract filename from the file path
-    filename = os.path.basename(file_path)
+    filename = filename or os.path.basename(file_path)
 
     post_headers = {"Authorization": f"Bearer {jwt_token}"}
     with open(file_path, "rb") as file:
-        response = requests.post(
-            f"https://{idx_address}/v1/upload?c={customer_id}&o={corpus_id}",
-            files={"file": (file.name, file, "application/octet-stream")},
+        response = session.post(
+            f"{_base_url(idx_address)}/v1/upload?c={customer_id}&o={corpus_id}",
+            files={"file": (filename, file, "application/octet-stream")},
             data={"doc_metadata": f'{{"filename": "{filename}"}}'},
             verify=True,
             headers=post_headers,
@@ -134,16 +208,120 @@ def upload_file(
     return message, True
 
 
+def index_document(
+    customer_id: int,
+    corpus_id: int,
+    idx_address: str,
+    jwt_token: str,
+    file_path: str,
+    filename: str = None,
+):
+    """Chunks a file locally and indexes it through the structured core-indexing API.
+
+    Text is extracted once, split into section- and sentence-aware chunks tagged
+    with patient, page and section metadata, and sent as a compact JSON document
+    instead of the binary file. Falls back to `upload_file` when the file yields
+    no text or the core-indexing request fails.
+
+    Args:
+        customer_id: Unique customer ID in vectara platform.
+        corpus_id: ID of the corpus to which data needs to be indexed.
+        idx_address: Address of the indexing server. e.g., api.vectara.io
+        jwt_token: A valid Auth token.
+        file_path: Path to the file to be indexed, e.g. a document store blob.
+        filename: Name to index the file under. Defaults to the basename of `file_path`.
+
+    Returns:
+        (response, True) in case of success and returns (error, False) in case of failure.
+    """
+    filename = filename or os.path.basename(file_path)
+    pages = extract_pages(file_path)
+    response, success = _index_pages(
+        customer_id, corpus_id, idx_address, jwt_token, file_path, filename, pages
+    )
+    if success:
+        # Keep the patient digest, lab index and dedup index in step with the corpus
+        update_patient_digest(file_path, pages, filename=filename)
+        get_lab_index().index_report(file_path, pages, filename=filename)
+        with open(file_path, "rb") as f:
+            get_index().add(filename, f.read(), "".join(pages))
+    return response, success
+
+
+def _index_pages(customer_id, corpus_id, idx_address, jwt_token, file_path, filename, pages):
+    document = build_core_document(file_path, pages, filename=filename)
+    if not document["parts"]:
+        return upload_file(customer_id, corpus_id, idx_address, jwt_token, file_path, filename)
+
+    payload = json.dumps(
+        {"customerId": customer_id, "corpusId": corpus_id, "document": document},
+        separators=(",", ":"),
+    )
+    stats = {
+        "file_bytes": os.path.getsize(file_path),
+        "payload_bytes": len(payload),
+        "chunks": len(document["parts"]),
+    }
+    logging.info(
+        "Indexing %s: %d bytes as file, %d bytes as %d chunks",
+        document["documentId"],
+        stats["file_bytes"],
+        stats["payload_bytes"],
+        stats["chunks"],
+    )
+
+    post_headers = {
+        "customer-id": f"{customer_id}",
+        "Authorization": f"Bearer {jwt_token}",
+        "Content-Type": "application/json",
+    }
+    try:
+        response = session.post(
+            f"{_base_url(idx_address)}/v1/core/index",
+            data=payload,
+            verify=True,
+            headers=post_headers,
+        )
+    except requests.RequestException as e:
+        logging.error("Core indexing failed: %s, falling back to file upload", e)
+        return upload_file(customer_id, corpus_id, idx_address, jwt_token, file_path, filename)
+
+    if response.status_code != 200:
+        logging.error(
+            "Core indexing failed with code %d, reason %s, text %s, falling back to file upload",
+            response.status_code,
+            response.reason,
+            response.text,
+        )
+        return upload_file(customer_id, corpus_id, idx_address, jwt_token, file_path, filename)
+
+    message = response.json()
+    if message.get("status") and message["status"].get("code") not in ("OK", "ALREADY_EXISTS"):
+        logging.error("Core indexing failed with status: %s", message["status"])
+        return message["status"], False
+
+    message["indexing_stats"] = stats
+    return message, True
+
+
 def upload_files_in_directory(
-    customer_id: int, corpus_id: int, idx_address: str, directory_path: str
+    customer_id: int,
+    corpus_id: int,
+    idx_address: str,
+    directory_path: str,
+    batch_size: int = 8,
 ):
     """Uploads all files in a directory to the corpus.
 
+    Files are chunked locally and indexed with `index_document`, `batch_size`
+    documents at a time over the shared connection pool.
+
     Args:
         customer_id: Unique customer ID in Vectara platform.
         corpus_id: ID of the corpus to which data needs to be indexed.
         idx_address: Address of the indexing server. e.g., api.vectara.io
         directory_path: Path to the directory containing files to be uploaded.
+        batch_size: Number of documents indexed concurrently.
 
     Returns:
         A list of tuples containing (response, success) for each file upload.
@@ -152,15 +330,65 @@ def upload_files_in_directory(
     if not jwt_token:
         return []
 
-    file_uploads = []
-    for file_name in os.listdir(directory_path):
-        file_path = os.path.join(directory_path, file_name)
-        if os.path.isfile(file_path):
-            response, success = upload_file(
-                customer_id, corpus_id, idx_address, jwt_token, file_path
+    file_paths = [
+        os.path.join(directory_path, file_name)
+        for file_name in sorted(os.listdir(directory_path))
+        if os.path.isfile(os.path.join(directory_path, file_name))
+    ]
+    with ThreadPoolExecutor(max_workers=batch_size) as executor:
+        return list(
+            executor.map(
+                lambda file_path: index_document(
+                    customer_id, corpus_id, idx_address, jwt_token, file_path
+                ),
+                file_paths,
             )
-            file_uploads.append((response, success))
-    return file_uploads
+        )
+
+
+def delete_document(
+    customer_id: int, corpus_id: int, idx_address: str, jwt_token: str, file_path: str
+):
+    """Deletes a document from the corpus and from the local digests and lab index.
+
+    Args:
+        customer_id: Unique customer ID in vectara platform.
+        corpus_id: ID of the corpus the document was indexed in.
+        idx_address: Address of the indexing server. e.g., api.vectara.io
+        jwt_token: A valid Auth token.
+        file_path: Path (or name) of the file the document was indexed from.
+
+    Returns:
+        (response, True) in case of success and returns (error, False) in case of failure.
+    """
+    document_id = os.path.basename(file_path)
+    post_headers = {
+        "customer-id": f"{customer_id}",
+        "Authorization": f"Bearer {jwt_token}",
+        "Content-Type": "application/json",
+    }
+    response = session.post(
+        f"{_base_url(idx_address)}/v1/delete-doc",
+        data=json.dumps(
+            {"customerId": customer_id, "corpusId": corpus_id, "documentId": document_id}
+        ),
+        verify=True,
+        headers=post_headers,
+    )
+
+    if response.status_code != 200:
+        logging.error(
+            "Delete failed with code %d, reason %s, text %s",
+            response.status_code,
+            response.reason,
+            response.text,
+        )
+        return response, False
+
+    remove_from_digest(file_path)
+    get_lab_index().remove_report(file_path)
+    get_store().remove_name(document_id)
+    return response.json(), True
 
 
 def _get_query_json(
@@ -208,6 +436,7 @@ def query_corpus(
     query: str,
     model="vectara-summary-ext-v1.2.0",
     language="eng",
+    hedge=None,
 ):
     """Queries the data.
 
@@ -216,28 +445,50 @@ def query_corpus(
         corpus_id: ID of the corpus to which data needs to be indexed.
         query_address: Address of the querying server. e.g., api.vectara.io
         jwt_token: A valid Auth token.
+        hedge: Send a duplicate request when the first one is slower than the
+            recent p95 latency and keep whichever answers first. Defaults to the
+            HEDGE_QUERIES environment variable; see `query_hedger.report()`.
 
     Returns:
-        (response, True) in case of success and returns (error, False) in case of failure.
+        (results, summary, factual_consistency_score, documents) in case of success
+        and returns (error, False) in case of failure. While Vectara is throttling
+        or unhealthy, the last good result for the same query is served instead.
 
     """
     post_headers = {
         "customer-id": f"{customer_id}",
         "Authorization": f"Bearer {jwt_token}",
     }
+    cache_key = (customer_id, corpus_id, query, model, language)
+    vectara = get_upstream("vectara")
+
+    def post():
+        return session.post(
+            f"{_base_url(query_address)}/v1/query",
+            data=_get_query_json(
+                customer_id,
+                corpus_id,
+                query,
+                summarizer_prompt_name=model,
+                response_lang=language,
+            ),
+            verify=True,
+            headers=post_headers,
+            timeout=QUERY_TIMEOUT,
+        )
 
-    response = requests.post(
-        f"https://{query_address}/v1/query",
-        data=_get_query_json(
-            customer_id,
-            corpus_id,
-            query,
-            summarizer_prompt_name=model,
-            response_lang=language,
-        ),
-        verify=True,
-        headers=post_headers,
-    )
+    hedge = HEDGE_QUERIES if hedge is None else hedge
+    try:
+        response = call_upstream(
+            "vectara", cache_key, (lambda: query_hedger.run(post)) if hedge else post
+        )
+    except (CircuitOpenError, requests.RequestException) as e:
+        cached = vectara.cache.get(cache_key)
+        if cached is not None:
+            logging.warning("Serving cached query result: %s", e)
+            return cached
+        logging.error("Query failed: %s", e)
+        return e, False
 
     if response.status_code != 200:
         logging.error(
@@ -246,6 +497,9 @@ def query_corpus(
             response.reason,
             response.text,
         )
+        cached = vectara.cache.get(cache_key)
+        if cached is not None:
+            return cached
         return response, False
 
     message = response.json()
@@ -263,48 +517,75 @@ def query_corpus(
     ]["score"]
 
     res = [[r["text"], r["score"]] for r in responses]
-    return res, summary, factual_consistency_score, documents
+    result = (res, summary, factual_consistency_score, documents)
+    vectara.cache.put(cache_key, result)
+    return result
+
+
+def find_duplicate(uploaded_file):
+    """Checks an upload against the corpus dedup index.
 
+    Exact copies are matched by content hash and re-scans or re-exports by
+    MinHash over the extracted text. Duplicates are linked to the original in
+    the index rather than stored again. New documents are only recorded by
+    `index_document` once indexing succeeds.
 
-def save_to_dir(uploaded_file):
+    Returns:
+        The `dedup.Duplicate` the upload matches, or None if it is new.
+    """
+    return get_index().check(
+        uploaded_file.name, bytes(uploaded_file.getbuffer()), extract_text(uploaded_file)
+    )
+
+
+def save_to_store(uploaded_file):
+    """Streams an upload into the document store under its upload name.
+
+    The content is stored once under its hash (see `docstore`) and indexed
+    straight from the blob, `get_store().path(content_hash)`, with the upload
+    name passed separately, so no second copy is written to disk.
+
+    Returns:
+        The SHA-256 of the upload.
+    """
     if uploaded_file is not None:
-        temp_dir = "corpus"
-        os.makedirs(temp_dir, exist_ok=True)
-        file_path = os.path.join(temp_dir, uploaded_file.name)
+        return get_store().put(uploaded_file.name, uploaded_file)
 
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
 
-        return file_path
+SYSTEM_PROMPT = "You are a knowledgeable agent specializing in the medical domain, proficient in interpreting and analyzing medical reports with precision and expertise."
 
 
-def get_report_summary(uploaded_file):
+def extract_text(uploaded_file):
+    """Extracts the text of an uploaded PDF, DOCX or TXT file.
+
+    Args:
+        uploaded_file: A file-like object with a `name` attribute, e.g. a Streamlit
+            UploadedFile or a `io.BytesIO` with `name` set.
 
+    Returns:
+        The extracted text, or an empty string for unsupported file types.
+    """
     file_extension = uploaded_file.name.split(".")[-1]
 
     if file_extension == "pdf":
         # Extract text from PDF
         pdf_reader = PyPDF2.PdfReader(uploaded_file)
-        text = "".join(
+        return "".join(
             pdf_reader.pages[page_num].extract_text()
             for page_num in range(len(pdf_reader.pages))
         )
-
-        if st.button("View Document Preview"):
-            binary_data = uploaded_file.getvalue()  
-            pdf_viewer(input=binary_data, width=700)
-
-        # st.markdown("## Medical Report Summary")
-        # st.markdown("### Data Preview")
     elif file_extension == "docx":
         # Extract text from DOCX
         docx_document = Document(uploaded_file)
-        text = "".join(paragraph.text + "\n" for paragraph in docx_document.paragraphs)
+        return "".join(paragraph.text + "\n" for paragraph in docx_document.paragraphs)
     elif file_extension == "txt":
         # Read text directly from TXT file
-        text = uploaded_file.getvalue().decode("utf-8")
+        return uploaded_file.getvalue().decode("utf-8")
+    return ""
 
-    query = f"""
+
+def _summary_prompt(text):
+    return f"""
     Assume you are a patient with limited medical knowledge who has received a medical report filled with complex terminology. You are seeking a clearer understanding of this report in two parts:
 
     1. **Report Explanation**: First, break down the medical report, keeping the original terms but explaining their significance. Detail what each finding or measurement within the report indicates about your health. Include any abnormalities or conditions detected, explaining what each part of the scan or test represents. 
@@ -319,37 +600,84 @@ def get_report_summary(uploaded_file):
 
     Medical report: {text}
     """
-    if st.button("Generate document summary"):
-        # # Together.AI call
-        # client = Together(api_key=TOGETHER_API_KEY)
-        # response = client.chat.completions.create(
-        #     model="meta-llama/Llama-3-70b-chat-hf",
-        #     messages=[
-        #         {
-        #             "role": "system",
-        #             "content": "You are a knowledgeable agent specializing in the medical domain, proficient in interpreting and analyzing medical reports with precision and expertise.",
-        #         },
-        #         {
-        #             "role": "user",
-        #             "content": query
-        #         }
-        #     ],
-        # )
-
-        #OpenAI call
-        client = OpenAI(api_key=OPENAI_API_KEY,)
-        response = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a knowledgeable agent specializing in the medical domain, proficient in interpreting and analyzing medical reports with precision and expertise.",
-                },
-                {
-                    "role": "user", 
-                    "content": query
-                },
-            ],
-            model="gpt-3.5-turbo",
+
+
+def summarize_report(text):
+    """Generates a patient-friendly summary of a medical report.
+
+    Args:
+        text: The extracted text of the report.
+
+    Returns:
+        The summary text, or None if the summarization service is unavailable.
+    """
+    query = _summary_prompt(text)
+
+    # # Together.AI call
+    # client = Together(api_key=TOGETHER_API_KEY)
+    # response = client.chat.completions.create(
+    #     model="meta-llama/Llama-3-70b-chat-hf",
+    #     messages=[
+    #         {
+    #             "role": "system",
+    #             "content": SYSTEM_PROMPT,
+    #         },
+    #         {
+    #             "role": "user",
+    #             "content": query
+    #         }
+    #     ],
+    # )
+
+    #OpenAI call
+    client = OpenAI(api_key=OPENAI_API_KEY,)
+    try:
+        response = call_upstream(
+            "openai",
+            query,
+            lambda: client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "system",
+                        "content": SYSTEM_PROMPT,
+                    },
+                    {
+                        "role": "user", 
+                        "content": query
+                    },
+                ],
+                model="gpt-3.5-turbo",
+            ),
         )
+    except (CircuitOpenError, APIError):
+        response = get_upstream("openai").cache.get(query)
+        if response is None:
+            return None
+    get_upstream("openai").cache.put(query, response)
+
+    return response.choices[0].message.content
+
+
+def get_report_summary(uploaded_file):
+
+    file_extension = uploaded_file.name.split(".")[-1]
+    text = extract_text(uploaded_file)
+
+    if file_extension == "pdf":
+        if st.toggle("View Document Preview"):
+            render_pdf_preview(
+                uploaded_file.getvalue(),
+                passages=[text for text, _ in st.session_state.get("last_results", [])],
+                key=f"preview_{uploaded_file.name}",
+            )
+
+        # st.markdown("## Medical Report Summary")
+        # st.markdown("### Data Preview")
+
+    if st.button("Generate document summary"):
+        summary = summarize_report(text)
+        if summary is None:
+            st.warning("The summarization service is busy, please try again shortly.")
+            return
 
-        st.write(response.choices[0].message.content)
+        st.write(summary)
@@ -0,0 +1,357 @@
+"""Structured index of vitals, lab values and medications.
+
+Numeric questions ("which patients have blood pressure above 140/90",
+"latest HbA1c for Lucas Graham") are answered from a SQLite table of values
+extracted at ingest, indexed by patient, measurement and date, instead of going
+through semantic search and LLM summarization.
+
+Backfill the index for an existing directory with:
+
+    python labs.py corpus
+"""
+import os
+import re
+import sys
+import time
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+from chunking import extract_pages, patient_from_filename
+
+LABS_DB = os.environ.get("LABS_DB", "labs.sqlite3")
+
+# name: (extraction pattern, unit). Blood pressure captures systolic/diastolic.
+MEASUREMENTS = {
+    "blood_pressure": (r"Blood Pressure\s*:?\s*(\d{2,3})\s*/\s*(\d{2,3})", "mmHg"),
+    "pulse": (r"(?:Pulse|Heart Rate)\s*:?\s*(\d{2,3})", "bpm"),
+    "temperature": (r"Temperature\s*:?\s*(\d{2}(?:\.\d+)?)\s*°?\s*C\b", "°C"),
+    "hba1c": (r"HbA1c\s*:?\s*(\d{1,2}(?:\.\d+)?)\s*%", "%"),
+    "glucose": (r"Glucose\s*:?\s*(\d{2,3}(?:\.\d+)?)\s*mg/dL", "mg/dL"),
+    "cholesterol": (r"Cholesterol\s*:?\s*(\d{2,3}(?:\.\d+)?)\s*mg/dL", "mg/dL"),
+    "weight": (r"Weight\s*:?\s*(\d{2,3}(?:\.\d+)?)\s*kg", "kg"),
+}
+
+SYNONYMS = {
+    "blood_pressure": r"blood pressure|\bbp\b",
+    "pulse": r"pulse|heart rate",
+    "temperature": r"temperature|\btemp\b|fever",
+    "hba1c": r"hba1c|\ba1c\b",
+    "glucose": r"glucose|blood sugar",
+    "cholesterol": r"cholesterol",
+    "weight": r"weight",
+}
+
+LABELS = {
+    "blood_pressure": "blood pressure",
+    "pulse": "pulse",
+    "temperature": "temperature",
+    "hba1c": "HbA1c",
+    "glucose": "glucose",
+    "cholesterol": "cholesterol",
+    "weight": "weight",
+}
+LOOKUP_INTENT = re.compile(
+    r"\b(latest|current|last|recent|what\s+(?:is|was|are)|what's|value|level|reading)\b", re.IGNORECASE
+)
+# Questions about causes or care need the reports, not a number
+OPEN_QUESTION = re.compile(
+    r"\b(why|how(?!\s+(?:many|much|high|low))|caus\w*|treat\w*|manag\w*|explain\w*|"
+    r"should|recommend\w*|risk\w*|reason\w*)\b",
+    re.IGNORECASE,
+)
+
+REPORT_DATE = re.compile(r"\b(?:Date of Visit|Visit Date|Date)\s*:\s*([A-Z][a-z]+ \d{1,2},\s*\d{4})")
+COMPARISON = re.compile(
+    r"\b(above|over|greater than|more than|higher than|at least|below|under|less than|lower than|at most)\s+"
+    r"(\d+(?:\.\d+)?)(?:\s*/\s*(\d+(?:\.\d+)?))?",
+    re.IGNORECASE,
+)
+OPERATORS = {
+    "above": ">", "over": ">", "greater than": ">", "more than": ">", "higher than": ">",
+    "at least": ">=", "below": "<", "under": "<", "less than": "<", "lower than": "<",
+    "at most": "<=",
+}
+AGGREGATES = {
+    "average": "AVG", "mean": "AVG", "highest": "MAX", "maximum": "MAX", "max": "MAX",
+    "lowest": "MIN", "minimum": "MIN", "min": "MIN",
+}
+
+# Readings without a visit date sort after dated ones, newest ingest first.
+_RECENT_FIRST = "date IS NULL, date DESC, ingested_at DESC"
+
+# Latest observation of a measurement, one row per patient.
+_LATEST = f"""
+    SELECT patient, date, value, value2, unit FROM (
+        SELECT *, ROW_NUMBER() OVER (
+            PARTITION BY patient ORDER BY {_RECENT_FIRST}, rowid DESC
+        ) AS recency
+        FROM observations WHERE name = ?
+    ) WHERE recency = 1
+"""
+
+
+def _report_date(text):
+    """Returns the visit date of a report as an ISO date, or None if it has none."""
+    match = REPORT_DATE.search(text)
+    if match:
+        try:
+            return datetime.strptime(" ".join(match.group(1).split()), "%B %d, %Y").date().isoformat()
+        except ValueError:
+            pass
+    return None
+
+
+def _when(report_date):
+    return report_date or "no visit date recorded"
+
+
+def extract_observations(text: str):
+    """Returns [(name, value, value2, unit)] for every measurement found in a report."""
+    observations = []
+    for name, (pattern, unit) in MEASUREMENTS.items():
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            value2 = float(match.group(2)) if match.lastindex and match.lastindex > 1 else None
+            observations.append((name, float(match.group(1)), value2, unit))
+    return observations
+
+
+def extract_medications(text: str):
+    """Returns the prescribed medications listed under "Medications Prescribed"."""
+    match = re.search(r"Medications Prescribed\s*:(.*?)(?:•\s*[A-Z][\w ]+?\s:|\n[A-Z][\w ]+:\s*\n|$)", text, re.S)
+    if not match:
+        return []
+    return [
+        " ".join(item.split())
+        for item in match.group(1).split("•")
+        if item.strip() and item.strip().lower() != "none" and not item.strip().endswith(":")
+    ]
+
+
+class LabIndex:
+    """SQLite store of observations and medications per patient and date."""
+
+    def __init__(self, path: str = LABS_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(observations)")}
+            if columns and "ingested_at" not in columns:
+                # Earlier versions stamped undated reports with the ingest day.
+                # The tables are derived data, rebuild them with `python labs.py corpus`.
+                logging.warning("Dropping lab index with an outdated schema, re-run the backfill")
+                self._conn.executescript(
+                    "DROP TABLE observations; DROP TABLE IF EXISTS medications;"
+                )
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS observations (
+                    patient TEXT NOT NULL,
+                    date TEXT,
+                    name TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    value2 REAL,
+                    unit TEXT,
+                    source TEXT NOT NULL,
+                    ingested_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS observations_patient ON observations(patient, name, date);
+                CREATE INDEX IF NOT EXISTS observations_value ON observations(name, value);
+                CREATE TABLE IF NOT EXISTS medications (
+                    patient TEXT NOT NULL,
+                    date TEXT,
+                    medication TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    ingested_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS medications_patient ON medications(patient, date);
+                """
+            )
+
+    def index_report(self, file_path: str, pages=None, filename: str = None):
+        """Extracts and stores the values of one report, replacing earlier values from it.
+
+        Values are dated with the report's visit date, or NULL when it has none.
+        The ingest time is kept separately to order undated reports. `filename`
+        names the report when `file_path` is a blob in the document store.
+
+        Returns:
+            The number of observations stored.
+        """
+        source = filename or os.path.basename(file_path)
+        patient = patient_from_filename(source)
+        if patient is None:
+            return 0
+        text = "\n".join(extract_pages(file_path) if pages is None else pages)
+        report_date = _report_date(text)
+        observations = extract_observations(text)
+        medications = extract_medications(text)
+        ingested_at = time.time()
+
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM observations WHERE source = ?", (source,))
+            self._conn.execute("DELETE FROM medications WHERE source = ?", (source,))
+            self._conn.executemany(
+                "INSERT INTO observations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (patient, report_date, *observation, source, ingested_at)
+                    for observation in observations
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO medications VALUES (?, ?, ?, ?, ?)",
+                [
+                    (patient, report_date, medication, source, ingested_at)
+                    for medication in medications
+                ],
+            )
+        return len(observations)
+
+    def remove_report(self, file_path: str):
+        source = os.path.basename(file_path)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM observations WHERE source = ?", (source,))
+            self._conn.execute("DELETE FROM medications WHERE source = ?", (source,))
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def patients(self):
+        return [
+            row[0]
+            for row in self.execute(
+                "SELECT patient FROM observations UNION SELECT patient FROM medications"
+            )
+        ]
+
+
+def _format(name, value, value2, unit):
+    if name == "blood_pressure":
+        return f"{value:g}/{value2:g} {unit}"
+    return f"{value:g} {unit}"
+
+
+def answer_numeric_query(query: str, index: "LabIndex" = None):
+    """Answers numeric filter, lookup and aggregate questions from the lab index.
+
+    Supports "patients with <measurement> above/below X[/Y]", "latest
+    <measurement> for <patient>", "average/highest/lowest <measurement>" and
+    "medications for <patient>".
+
+    Returns:
+        A markdown answer, or None if the question is not a numeric one (or asks
+        why, how or about treatment) so the caller falls back to `query_corpus`.
+    """
+    if OPEN_QUESTION.search(query):
+        return None
+    index = index or get_index()
+    lowered = query.lower()
+    # Whole words only, longest names first, so "Lee" never matches "sleep"
+    patient = next(
+        (
+            p
+            for p in sorted(index.patients(), key=len, reverse=True)
+            if re.search(rf"\b{re.escape(p.lower())}\b", lowered)
+        ),
+        None,
+    )
+
+    if patient and re.search(r"medication|medicine|prescri|drug", lowered):
+        rows = index.execute(
+            f"SELECT date, medication FROM medications WHERE patient = ? ORDER BY {_RECENT_FIRST}",
+            (patient,),
+        )
+        if not rows:
+            return f"No medications are recorded for {patient}."
+        return f"Medications for {patient}:\n" + "\n".join(f"- {m} ({_when(d)})" for d, m in rows)
+
+    name = next((n for n, pattern in SYNONYMS.items() if re.search(pattern, lowered)), None)
+    if name is None:
+        return None
+    label = LABELS[name]
+
+    if patient and LOOKUP_INTENT.search(query):
+        rows = index.execute(
+            "SELECT date, value, value2, unit FROM observations WHERE patient = ? AND name = ? "
+            f"ORDER BY {_RECENT_FIRST}, rowid DESC LIMIT 1",
+            (patient, name),
+        )
+        if not rows:
+            return f"No {label} is recorded for {patient}."
+        d, value, value2, unit = rows[0]
+        return f"Latest {label} for {patient}: {_format(name, value, value2, unit)} ({_when(d)})"
+
+    comparison = COMPARISON.search(query)
+    if comparison:
+        operator = OPERATORS[comparison.group(1).lower()]
+        threshold, threshold2 = float(comparison.group(2)), comparison.group(3)
+        where = f"value {operator} ?"
+        params = [name, threshold]
+        if name == "blood_pressure" and threshold2 is not None:
+            # Either component past its threshold counts, e.g. above 140/90
+            joiner = "OR" if operator.startswith(">") else "AND"
+            where = f"(value {operator} ? {joiner} value2 {operator} ?)"
+            params.append(float(threshold2))
+        rows = index.execute(
+            f"SELECT * FROM ({_LATEST}) WHERE {where} ORDER BY value DESC", params
+        )
+        threshold_text = comparison.group(0)
+        if not rows:
+            return f"No patients have {label} {threshold_text}."
+        return f"Patients with {label} {threshold_text}:\n" + "\n".join(
+            f"- {p}: {_format(name, v, v2, u)} ({_when(d)})" for p, d, v, v2, u in rows
+        )
+
+    aggregate = next((AGGREGATES[w] for w in re.findall(r"\w+", lowered) if w in AGGREGATES), None)
+    if aggregate == "AVG":
+        rows = index.execute(
+            f"SELECT AVG(value), AVG(value2), COUNT(*), MAX(unit) FROM ({_LATEST})", (name,)
+        )
+        value, value2, count, unit = rows[0]
+        if not count:
+            return f"No {label} values are recorded."
+        value, value2 = round(value, 1), round(value2, 1) if value2 is not None else None
+        return f"Average {label} across {count} patients: {_format(name, value, value2, unit)}"
+    if aggregate:
+        # Take one patient's whole reading, never MAX(value) with MAX(value2)
+        direction = "DESC" if aggregate == "MAX" else "ASC"
+        rows = index.execute(
+            f"SELECT patient, date, value, value2, unit, COUNT(*) OVER () FROM ({_LATEST}) "
+            f"ORDER BY value {direction}, value2 {direction} LIMIT 1",
+            (name,),
+        )
+        if not rows:
+            return f"No {label} values are recorded."
+        p, d, value, value2, unit, count = rows[0]
+        word = "Highest" if aggregate == "MAX" else "Lowest"
+        return (
+            f"{word} {label} across {count} patients: {_format(name, value, value2, unit)} "
+            f"({p}, {_when(d)})"
+        )
+
+    return None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> LabIndex:
+    """Returns the process-wide `LabIndex` stored at LABS_DB."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = LabIndex()
+        return _index
+
+
+if __name__ == "__main__":
+    for directory in sys.argv[1:] or ["corpus"]:
+        for file_name in sorted(os.listdir(directory)):
+            file_path = os.path.join(directory, file_name)
+            if os.path.isfile(file_path):
+                count = get_index().index_report(file_path)
+                print(f"{file_name}: {count} observations")
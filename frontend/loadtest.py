@@ -0,0 +1,70 @@
+"""Load test for the headless search service.
+
+Start the mock upstream and the service against it, then run:
+
+    python loadtest.py --url http://127.0.0.1:8080 --concurrency 32 --duration 30
+"""
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+import aiohttp
+
+QUERIES = [
+    "Summarize the medical history of Benjamin Lee",
+    "Which patients have chronic kidney disease?",
+    "What medications were prescribed for migraines?",
+    "List patients with elevated blood pressure",
+    "What are the follow-up plans for Amelia Sanchez?",
+]
+
+
+async def _worker(session, url, deadline, latencies, statuses):
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        try:
+            async with session.post(f"{url}/query", json={"query": random.choice(QUERIES)}) as response:
+                await response.read()
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+        except aiohttp.ClientError:
+            statuses["error"] = statuses.get("error", 0) + 1
+            continue
+        latencies.append(time.monotonic() - start)
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run(url, concurrency, duration):
+    latencies, statuses = [], {}
+    deadline = time.monotonic() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(
+            *(_worker(session, url, deadline, latencies, statuses) for _ in range(concurrency))
+        )
+
+    print(f"Requests:   {sum(statuses.values())} ({statuses})")
+    print(f"Throughput: {len(latencies) / duration:.1f} req/s")
+    if latencies:
+        print(f"Latency:    mean {statistics.mean(latencies) * 1000:.0f} ms, "
+              f"p50 {_percentile(latencies, 50) * 1000:.0f} ms, "
+              f"p95 {_percentile(latencies, 95) * 1000:.0f} ms, "
+              f"p99 {_percentile(latencies, 99) * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the search service")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.concurrency, args.duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Local mock of the Vectara, auth and OpenAI endpoints used for load testing.
+
+Run with:
+
+    python mock_upstream.py --port 8081 --latency 0.2 --throttle-rate 0.05
+
+and point the app at it:
+
+    AUTH_URL=http://127.0.0.1:8081/oauth2/token
+    IDX_ADDRESS=http://127.0.0.1:8081
+    OPENAI_BASE_URL=http://127.0.0.1:8081/v1
+"""
+import json
+import random
+import asyncio
+import argparse
+
+from aiohttp import web
+
+
+async def _delay(request):
+    config = request.app["config"]
+    await asyncio.sleep(random.expovariate(1 / config["latency"]) if config["latency"] else 0)
+
+
+def _throttled(request):
+    if random.random() < request.app["config"]["throttle_rate"]:
+        return web.json_response(
+            {"error": "Too many requests"}, status=429, headers={"Retry-After": "1"}
+        )
+    return None
+
+
+async def handle_token(request):
+    return web.json_response({"access_token": "mock-token", "expires_in": 3600})
+
+
+async def handle_query(request):
+    await _delay(request)
+    throttled = _throttled(request)
+    if throttled:
+        return throttled
+    body = json.loads(await request.text())
+    query = body["query"][0]["query"]
+    num_results = body["query"][0].get("num_results", 5)
+    return web.json_response(
+        {
+            "status": [],
+            "responseSet": [
+                {
+                    "response": [
+                        {"text": f"Passage {i} for {query}", "score": 1 - i / 10, "documentIndex": 0}
+                        for i in range(num_results)
+                    ],
+                    "document": [{"id": "mock.pdf", "metadata": [{"name": "filename", "value": "mock.pdf"}]}],
+                    "summary": [
+                        {"text": f"Mock summary for: {query}", "factualConsistency": {"score": 0.9}}
+                    ],
+                }
+            ],
+        }
+    )
+
+
+async def handle_upload(request):
+    await _delay(request)
+    await request.read()
+    return web.json_response({"response": {"status": None}})
+
+
+async def handle_core_index(request):
+    await _delay(request)
+    await request.read()
+    return web.json_response({"status": {"code": "OK"}})
+
+
+async def handle_delete_doc(request):
+    await _delay(request)
+    await request.read()
+    return web.json_response({})
+
+
+async def handle_chat_completion(request):
+    await _delay(request)
+    throttled = _throttled(request)
+    if throttled:
+        return throttled
+    return web.json_response(
+        {
+            "id": "mock",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-3.5-turbo",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "Mock report summary."},
+                }
+            ],
+        }
+    )
+
+
+def create_app(latency, throttle_rate):
+    app = web.Application(client_max_size=50 * 1024**2)
+    app["config"] = {"latency": latency, "throttle_rate": throttle_rate}
+    app.add_routes(
+        [
+            web.post("/oauth2/token", handle_token),
+            web.post("/v1/query", handle_query),
+            web.post("/v1/upload", handle_upload),
+            web.post("/v1/core/index", handle_core_index),
+            web.post("/v1/delete-doc", handle_delete_doc),
+            web.post("/v1/chat/completions", handle_chat_completion),
+        ]
+    )
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Vectara/OpenAI upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean latency in seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of 429s")
+    args = parser.parse_args()
+    web.run_app(create_app(args.latency, args.throttle_rate), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
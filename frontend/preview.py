@@ -0,0 +1,130 @@
+"""Page-range PDF previews.
+
+Instead of shipping the whole document to the browser on every rerun, only the
+requested pages are sliced into a small PDF. Slices and per-page text are
+cached by content hash, and the next page range is prefetched in the background.
+"""
+import io
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import PyPDF2
+import streamlit as st
+from streamlit_pdf_viewer import pdf_viewer
+
+from resilience import ResultCache
+
+PAGES_PER_VIEW = 2
+
+_slices = ResultCache(max_entries=256, ttl=3600.0)
+_page_texts = ResultCache(max_entries=64, ttl=3600.0)
+_prefetcher = ThreadPoolExecutor(max_workers=1)
+
+
+def _normalize(text):
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def page_texts(data: bytes, content_hash: str = None):
+    """Returns the normalized text of each page, cached by content hash."""
+    content_hash = content_hash or hashlib.sha256(data).hexdigest()
+    texts = _page_texts.get(content_hash)
+    if texts is None:
+        reader = PyPDF2.PdfReader(io.BytesIO(data))
+        texts = [_normalize(page.extract_text() or "") for page in reader.pages]
+        _page_texts.put(content_hash, texts)
+    return texts
+
+
+def slice_pdf(data: bytes, start: int, end: int, content_hash: str = None) -> bytes:
+    """Returns a PDF containing only pages `start` to `end` (1-based, inclusive)."""
+    content_hash = content_hash or hashlib.sha256(data).hexdigest()
+    key = (content_hash, start, end)
+    sliced = _slices.get(key)
+    if sliced is None:
+        reader = PyPDF2.PdfReader(io.BytesIO(data))
+        writer = PyPDF2.PdfWriter()
+        for page_number in range(start - 1, min(end, len(reader.pages))):
+            writer.add_page(reader.pages[page_number])
+        output = io.BytesIO()
+        writer.write(output)
+        sliced = output.getvalue()
+        _slices.put(key, sliced)
+    return sliced
+
+
+def get_preview(data: bytes, page: int, pages_per_view: int = PAGES_PER_VIEW):
+    """Returns the sliced PDF starting at `page` and prefetches the following range.
+
+    Returns:
+        (sliced_pdf_bytes, page_count)
+    """
+    content_hash = hashlib.sha256(data).hexdigest()
+    page_count = len(page_texts(data, content_hash))
+    page = max(1, min(page, page_count))
+    end = min(page + pages_per_view - 1, page_count)
+    sliced = slice_pdf(data, page, end, content_hash)
+    if end < page_count:
+        _prefetcher.submit(
+            slice_pdf, data, end + 1, min(end + pages_per_view, page_count), content_hash
+        )
+    return sliced, page_count
+
+
+def find_passage_pages(data: bytes, passages):
+    """Returns the sorted 1-based pages containing any of the retrieved passages.
+
+    A passage matches a page when its first words appear in the page text, which
+    tolerates the passage being cut mid-sentence by the retriever.
+    """
+    texts = page_texts(data)
+    pages = set()
+    for passage in passages:
+        words = _normalize(passage).split()
+        if not words:
+            continue
+        probe = " ".join(words[:8])
+        for page_number, text in enumerate(texts, start=1):
+            if probe in text:
+                pages.add(page_number)
+                break
+    return sorted(pages)
+
+
+def render_pdf_preview(data: bytes, passages=None, key: str = "preview"):
+    """Renders a paged preview of a PDF with Streamlit.
+
+    Args:
+        data: The PDF content.
+        passages: Optional retrieved passages (e.g. from `query_corpus`) whose
+            pages are offered as jump targets.
+        key: Widget key prefix.
+    """
+    page_key = f"{key}_page"
+    if page_key not in st.session_state:
+        st.session_state[page_key] = 1
+
+    def jump_to_passage():
+        if st.session_state[f"{key}_jump"]:
+            st.session_state[page_key] = st.session_state[f"{key}_jump"]
+
+    passage_pages = find_passage_pages(data, passages) if passages else []
+    if passage_pages:
+        st.selectbox(
+            "Jump to page with retrieved passage",
+            options=passage_pages,
+            index=None,
+            key=f"{key}_jump",
+            on_change=jump_to_passage,
+        )
+
+    sliced, page_count = get_preview(data, st.session_state[page_key])
+    st.number_input(
+        f"Page (of {page_count})",
+        min_value=1,
+        max_value=page_count,
+        step=PAGES_PER_VIEW,
+        key=page_key,
+    )
+    pdf_viewer(input=sliced, width=700)
@@ -0,0 +1,458 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+
+
+# SQLite file backing the caches shared by all processes on a host (service
+# workers, Streamlit, the sync daemon).
+SHARED_CACHE_DB = os.environ.get("SHARED_CACHE_DB", "shared_cache.sqlite3")
+
+# Starting limits per upstream. The token bucket adapts the rate from here
+# whenever the provider answers with a 429.
+UPSTREAM_DEFAULTS = {
+    "vectara": {"rate": 10.0, "capacity": 20, "failure_threshold": 5, "reset_timeout": 30.0},
+    "openai": {"rate": 3.0, "capacity": 6, "failure_threshold": 3, "reset_timeout": 60.0},
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised when an upstream is failing and calls are short-circuited."""
+
+    def __init__(self, upstream: str):
+        super().__init__(f"Circuit for upstream '{upstream}' is open")
+        self.upstream = upstream
+
+
+def parse_retry_after(value):
+    """Returns the number of seconds a `Retry-After` header asks us to wait.
+
+    The header is either a number of seconds or an HTTP date. Returns None when
+    the header is missing or cannot be parsed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Client-side rate limiter whose refill rate is learned from throttling.
+
+    The rate is halved on every 429 (and the bucket is paused for `Retry-After`
+    seconds when given), then grows back additively on each success.
+    """
+
+    def __init__(self, rate: float, capacity: int, min_rate: float = 0.2, increase: float = 0.1):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.blocked_until = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, timeout: float = 30.0) -> bool:
+        """Blocks until a token is available. Returns False if `timeout` expires first."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            if now + delay > deadline:
+                return False
+            time.sleep(delay)
+
+    def on_throttled(self, retry_after=None):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        logging.warning("Throttled by upstream, rate lowered to %.2f req/s", self.rate)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class CircuitBreaker:
+    """Fails fast after repeated upstream failures.
+
+    After `failure_threshold` consecutive failures the circuit opens for
+    `reset_timeout` seconds, then lets a single trial call through (half-open).
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def release_trial(self):
+        """Returns an unused half-open trial slot, going back to OPEN."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class SharedCache:
+    """Best-effort TTL cache in a SQLite file, shared between processes.
+
+    Values are pickled, keys are namespaced and hashed. SQLite errors (e.g. a
+    locked or read-only file) are logged and treated as cache misses.
+    """
+
+    def __init__(self, namespace: str, path: str = SHARED_CACHE_DB):
+        self.namespace = namespace
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache ("
+                    "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+                )
+            self._local.conn = conn
+        return conn
+
+    def _key(self, key):
+        return hashlib.sha256(repr((self.namespace, key)).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        try:
+            row = self._conn().execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                (self._key(key), time.time()),
+            ).fetchone()
+            return pickle.loads(row[0]) if row else None
+        except (sqlite3.Error, pickle.PickleError) as e:
+            logging.warning("Shared cache read failed: %s", e)
+            return None
+
+    def put(self, key, value, ttl: float):
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                    (self._key(key), pickle.dumps(value), time.time() + ttl),
+                )
+                conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        except (sqlite3.Error, pickle.PickleError, TypeError, AttributeError) as e:
+            logging.warning("Shared cache write failed: %s", e)
+
+
+class ResultCache:
+    """Thread-safe LRU cache with a time-to-live per entry.
+
+    With `shared`, entries are also written to a `SharedCache` and local misses
+    are looked up there, so other processes see the same results.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3600.0, shared: SharedCache = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if time.monotonic() - stored_at <= self.ttl:
+                    self._data.move_to_end(key)
+                    return value
+                del self._data[key]
+        if self.shared is None:
+            return None
+        value = self.shared.get(key)
+        if value is not None:
+            self._put_local(key, value)
+        return value
+
+    def _put_local(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def put(self, key, value):
+        self._put_local(key, value)
+        if self.shared is not None:
+            self.shared.put(key, value, self.ttl)
+
+
+class RequestCoalescer:
+    """Lets identical in-flight calls share a single upstream request."""
+
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._inflight[key] = call
+
+        if not leader:
+            call["done"].wait()
+        else:
+            try:
+                call["result"] = fn()
+            except Exception as e:
+                call["error"] = e
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                call["done"].set()
+
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+
+class Upstream:
+    """Rate limiter, circuit breaker, coalescer and fallback cache for one provider."""
+
+    def __init__(self, name, rate, capacity, failure_threshold, reset_timeout):
+        self.name = name
+        self.bucket = TokenBucket(rate, capacity)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.coalescer = RequestCoalescer()
+        self.cache = ResultCache(shared=SharedCache(f"upstream:{name}"))
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(name: str) -> Upstream:
+    """Returns the process-wide `Upstream` for `name`, creating it on first use."""
+    with _upstreams_lock:
+        if name not in _upstreams:
+            _upstreams[name] = Upstream(name, **UPSTREAM_DEFAULTS.get(name, UPSTREAM_DEFAULTS["vectara"]))
+        return _upstreams[name]
+
+
+def _status_and_headers(obj):
+    """Extracts an HTTP status and headers from a response or an HTTP client error."""
+    status = getattr(obj, "status_code", None)
+    headers = getattr(obj, "headers", None)
+    response = getattr(obj, "response", None)
+    if response is not None and (status is None or headers is None):
+        status = status or getattr(response, "status_code", None)
+        headers = getattr(response, "headers", None)
+    return status, headers or {}
+
+
+def _record(upstream, obj):
+    status, headers = _status_and_headers(obj)
+    if status == 429:
+        upstream.bucket.on_throttled(parse_retry_after(headers.get("Retry-After")))
+        upstream.breaker.record_failure()
+    elif status is not None and status >= 500:
+        upstream.breaker.record_failure()
+    else:
+        upstream.bucket.on_success()
+        upstream.breaker.record_success()
+
+
+def call_upstream(name: str, key, fn, timeout: float = 30.0):
+    """Calls `fn` through the rate limiter, circuit breaker and coalescer of an upstream.
+
+    Args:
+        name: Upstream name, e.g. "vectara" or "openai".
+        key: Hashable key identifying the request. Concurrent calls with the same
+            key share one upstream call.
+        fn: Zero-argument callable performing the request.
+        timeout: Maximum number of seconds to wait for a rate limit token.
+
+    Returns:
+        Whatever `fn` returns.
+
+    Raises:
+        CircuitOpenError: if the upstream is unhealthy or no token could be acquired.
+    """
+    upstream = get_upstream(name)
+
+    def guarded():
+        if not upstream.breaker.allow_request():
+            raise CircuitOpenError(name)
+        if not upstream.bucket.acquire(timeout):
+            # Give back the half-open trial slot, if we held it, so the next
+            # call can probe the upstream instead of being rejected forever
+            upstream.breaker.release_trial()
+            raise CircuitOpenError(name)
+        try:
+            result = fn()
+        except Exception as e:
+            status, _ = _status_and_headers(e)
+            if status is None:
+                upstream.breaker.record_failure()
+            else:
+                _record(upstream, e)
+            raise
+        _record(upstream, result)
+        return result
+
+    return upstream.coalescer.do(key, guarded)
+
+
+class Hedger:
+    """Issues a duplicate request when the first one is slower than usual.
+
+    The hedge deadline is the `percentile` of recently observed latencies. Extra
+    load is capped by a budget: each request earns `budget` hedge tokens (up to
+    `burst`) and each hedge spends one, so at most about `budget` of the
+    requests are duplicated.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        budget: float = 0.1,
+        burst: float = 5.0,
+        default_deadline: float = 2.0,
+        min_samples: int = 20,
+        max_workers: int = 32,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.default_deadline = default_deadline
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=500)
+        self.tokens = burst
+        self.stats = {"requests": 0, "hedges_fired": 0, "hedges_won": 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+
+    def deadline(self) -> float:
+        """Seconds to wait for the first attempt before hedging."""
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return self.default_deadline
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    def _timed(self, fn):
+        start = time.monotonic()
+        result = fn()
+        with self._lock:
+            self.latencies.append(time.monotonic() - start)
+        return result
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.stats["hedges_fired"] += 1
+                return True
+            return False
+
+    def run(self, fn):
+        """Calls `fn`, hedging with a second call if the first misses the deadline.
+
+        Returns:
+            The result of whichever attempt succeeds first. The losing attempt is
+            cancelled if it has not started, and its response is closed otherwise.
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+            self.tokens = min(self.burst, self.tokens + self.budget)
+
+        primary = self._executor.submit(self._timed, fn)
+        done, _ = wait([primary], timeout=self.deadline())
+        if done or not self._take_budget():
+            return primary.result()
+
+        hedge = self._executor.submit(self._timed, fn)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for loser in pending:
+                    if not loser.cancel():
+                        loser.add_done_callback(_close_result)
+                if future is hedge:
+                    with self._lock:
+                        self.stats["hedges_won"] += 1
+                return future.result()
+        raise error
+
+    def report(self) -> dict:
+        """Returns request, hedge and win counts and the current deadline."""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["deadline"] = round(self.deadline(), 3)
+        return stats
+
+
+def _close_result(future):
+    if not future.cancelled() and future.exception() is None:
+        close = getattr(future.result(), "close", None)
+        if close is not None:
+            close()
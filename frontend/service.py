@@ -0,0 +1,312 @@
+"""Headless HTTP search service exposing `helpers` to other SimpliMedi components.
+
+Run with:
+
+    python service.py --port 8080 --workers 4
+
+Endpoints:
+    POST /query         {"query": "...", "model": "...", "language": "eng"}
+    POST /query/batch   {"queries": ["...", "..."], "model": "...", "language": "eng"}
+    POST /upload        multipart form with a "file" field
+    POST /summary       multipart form with a "file" field
+    GET  /health
+
+Within a worker process, all requests share the pooled HTTP session from
+`helpers`. The JWT token and the upstream result caches are also backed by a
+SQLite file (`resilience.SHARED_CACHE_DB`), so every worker reuses the token
+and results fetched by the others.
+
+On platforms without SO_REUSEPORT (Windows) a single worker is started.
+"""
+import io
+import os
+import asyncio
+import logging
+import socket
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from docstore import get_store
+from digests import lookup_patient_digest
+from labs import answer_numeric_query
+from helpers import (
+    CORPUS_ID,
+    CUSTOMER_ID,
+    IDX_ADDRESS,
+    extract_text,
+    find_duplicate,
+    get_jwt_token,
+    index_document,
+    models,
+    query_hedger,
+    query_corpus,
+    save_to_store,
+    summarize_report,
+)
+
+REQUEST_TIMEOUT = float(os.environ.get("SERVICE_REQUEST_TIMEOUT", 30))
+MAX_INFLIGHT = int(os.environ.get("SERVICE_MAX_INFLIGHT", 64))
+MAX_BATCH_SIZE = int(os.environ.get("SERVICE_MAX_BATCH_SIZE", 20))
+THREADS_PER_WORKER = int(os.environ.get("SERVICE_THREADS_PER_WORKER", 16))
+
+executor = ThreadPoolExecutor(max_workers=THREADS_PER_WORKER)
+
+# Jobs submitted to the executor and not finished yet, running or queued. A job
+# keeps its slot after its request timed out, until its thread is done with it.
+_occupancy = {"jobs": 0}
+_occupancy_lock = threading.Lock()
+
+
+def _release_slot(_future):
+    with _occupancy_lock:
+        _occupancy["jobs"] -= 1
+
+
+def executor_occupancy() -> int:
+    with _occupancy_lock:
+        return _occupancy["jobs"]
+
+
+def _run_blocking(fn, *args):
+    """Runs a blocking helper on the worker thread pool with the request timeout.
+
+    The job is submitted immediately and counted against MAX_INFLIGHT until
+    its thread finishes, even if the request gives up waiting for it.
+    """
+    with _occupancy_lock:
+        _occupancy["jobs"] += 1
+    future = executor.submit(fn, *args)
+    future.add_done_callback(_release_slot)
+    return asyncio.wait_for(asyncio.wrap_future(future), REQUEST_TIMEOUT)
+
+
+def _overloaded():
+    return web.json_response(
+        {"error": "Service overloaded"}, status=503, headers={"Retry-After": "1"}
+    )
+
+
+@web.middleware
+async def backpressure_middleware(request, handler):
+    """Rejects requests with 503 once MAX_INFLIGHT executor jobs are outstanding."""
+    if executor_occupancy() >= MAX_INFLIGHT:
+        return _overloaded()
+    try:
+        return await handler(request)
+    except asyncio.TimeoutError:
+        return web.json_response({"error": "Request timed out"}, status=504)
+
+
+def _run_query(query, model, language):
+    digest = lookup_patient_digest(query)
+    if digest is not None:
+        return {"query": query, "summary": digest, "source": "digest"}
+    answer = answer_numeric_query(query)
+    if answer is not None:
+        return {"query": query, "summary": answer, "source": "labs"}
+    result = query_corpus(
+        CUSTOMER_ID,
+        CORPUS_ID,
+        IDX_ADDRESS,
+        get_jwt_token(),
+        query,
+        model=model,
+        language=language,
+    )
+    if result[-1] is False:
+        return {"query": query, "error": str(result[0])}
+    results, summary, score, documents = result
+    return {
+        "query": query,
+        "results": results,
+        "summary": summary,
+        "factual_consistency_score": score,
+        "documents": documents,
+    }
+
+
+async def _read_json(request):
+    """Returns the JSON object body of a request, or None if it is not one."""
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def _bad_request(message):
+    return web.json_response({"error": message}, status=400)
+
+
+def _query_params(body):
+    model = body.get("model", models["GPT-3.5-Turbo"])
+    language = body.get("language", "eng")
+    return model, language
+
+
+async def handle_query(request):
+    body = await _read_json(request)
+    if body is None:
+        return _bad_request("Expected a JSON object")
+    if not body.get("query") or not isinstance(body["query"], str):
+        return _bad_request("Missing 'query'")
+    result = await _run_blocking(_run_query, body["query"], *_query_params(body))
+    return web.json_response(result, status=502 if "error" in result else 200)
+
+
+def _batch_error(result):
+    if isinstance(result, asyncio.TimeoutError):
+        return "Request timed out"
+    logging.error("Batch query failed: %r", result)
+    return f"Query failed: {result}"
+
+
+async def handle_query_batch(request):
+    body = await _read_json(request)
+    if body is None:
+        return _bad_request("Expected a JSON object")
+    queries = body.get("queries") or []
+    if (
+        not isinstance(queries, list)
+        or not 1 <= len(queries) <= MAX_BATCH_SIZE
+        or not all(isinstance(query, str) and query for query in queries)
+    ):
+        return _bad_request(f"Expected 1 to {MAX_BATCH_SIZE} non-empty string 'queries'")
+    # A batch takes one executor slot per query
+    if executor_occupancy() + len(queries) > MAX_INFLIGHT:
+        return _overloaded()
+    model, language = _query_params(body)
+    results = await asyncio.gather(
+        *(_run_blocking(_run_query, query, model, language) for query in queries),
+        return_exceptions=True,
+    )
+    return web.json_response(
+        {
+            "results": [
+                {"query": query, "error": _batch_error(result)}
+                if isinstance(result, Exception)
+                else result
+                for query, result in zip(queries, results)
+            ]
+        }
+    )
+
+
+async def _read_upload(request):
+    """Reads the "file" field of a multipart request into a named in-memory file."""
+    reader = await request.multipart()
+    async for part in reader:
+        if part.name == "file" and part.filename:
+            uploaded_file = io.BytesIO(await part.read())
+            uploaded_file.name = os.path.basename(part.filename)
+            return uploaded_file
+    return None
+
+
+def _save_and_upload(uploaded_file):
+    duplicate = find_duplicate(uploaded_file)
+    if duplicate is not None:
+        return {"filename": uploaded_file.name, "success": True, "duplicate_of": duplicate.name}
+    content_hash = save_to_store(uploaded_file)
+    response, success = index_document(
+        CUSTOMER_ID,
+        CORPUS_ID,
+        IDX_ADDRESS,
+        get_jwt_token(),
+        get_store().path(content_hash),
+        filename=uploaded_file.name,
+    )
+    result = {"filename": uploaded_file.name, "success": success}
+    if success and isinstance(response, dict) and "indexing_stats" in response:
+        result["indexing_stats"] = response["indexing_stats"]
+    return result
+
+
+def _summarize(uploaded_file):
+    return summarize_report(extract_text(uploaded_file))
+
+
+async def handle_upload(request):
+    uploaded_file = await _read_upload(request)
+    if uploaded_file is None:
+        return web.json_response({"error": "Missing 'file'"}, status=400)
+    result = await _run_blocking(_save_and_upload, uploaded_file)
+    return web.json_response(result, status=200 if result["success"] else 502)
+
+
+async def handle_summary(request):
+    uploaded_file = await _read_upload(request)
+    if uploaded_file is None:
+        return web.json_response({"error": "Missing 'file'"}, status=400)
+    summary = await _run_blocking(_summarize, uploaded_file)
+    if summary is None:
+        return web.json_response(
+            {"error": "Summarization service unavailable"},
+            status=503,
+            headers={"Retry-After": "5"},
+        )
+    return web.json_response({"filename": uploaded_file.name, "summary": summary})
+
+
+async def handle_health(request):
+    return web.json_response(
+        {
+            "status": "ok",
+            "inflight": executor_occupancy(),
+            "hedging": query_hedger.report(),
+        }
+    )
+
+
+def create_app():
+    app = web.Application(
+        middlewares=[backpressure_middleware], client_max_size=50 * 1024**2
+    )
+    app.add_routes(
+        [
+            web.post("/query", handle_query),
+            web.post("/query/batch", handle_query_batch),
+            web.post("/upload", handle_upload),
+            web.post("/summary", handle_summary),
+            web.get("/health", handle_health),
+        ]
+    )
+    return app
+
+
+def _serve(host, port, reuse_port=True):
+    web.run_app(create_app(), host=host, port=port, reuse_port=reuse_port, print=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpliMedi-Search HTTP service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not hasattr(socket, "SO_REUSEPORT"):
+        logging.warning("SO_REUSEPORT is not supported here, starting a single worker")
+        _serve(args.host, args.port, reuse_port=False)
+        return
+    logging.info("Starting %d workers on %s:%d", args.workers, args.host, args.port)
+
+    # Each worker binds the same port with SO_REUSEPORT and the kernel balances
+    # connections between them.
+    workers = [
+        multiprocessing.Process(target=_serve, args=(args.host, args.port))
+        for _ in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Long-running daemon keeping the Vectara corpus in sync with a directory.
+
+Files dropped into the corpus directory (e.g. by the EHR export job) are
+picked up without anyone using the Streamlit uploader. Changes are detected
+with inotify through `watchdog` when it is installed, or by polling otherwise.
+Bursts of events are debounced, and only additions, modifications and
+deletions since the last run are pushed. A checkpoint of (mtime, size, sha256)
+per file is persisted after every change, so a restart only syncs what changed
+while the daemon was down.
+
+Run with:
+
+    python sync.py corpus --debounce 2 --poll-interval 30
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+
+from chunking import extract_pages
+from dedup import get_index as get_dedup_index
+from helpers import (
+    CORPUS_ID,
+    CUSTOMER_ID,
+    IDX_ADDRESS,
+    delete_document,
+    get_jwt_token,
+    index_document,
+)
+
+
+def _sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CorpusSync:
+    """Diffs a directory against a persisted checkpoint and pushes the deltas."""
+
+    def __init__(self, directory: str, checkpoint_path: str = None):
+        self.directory = directory
+        # Kept next to the directory, not inside it, so it is never uploaded
+        directory = os.path.abspath(directory)
+        self.checkpoint_path = checkpoint_path or os.path.join(
+            os.path.dirname(directory), f".{os.path.basename(directory)}_sync_checkpoint.json"
+        )
+        self.checkpoint = {}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                self.checkpoint = json.load(f)
+
+    def _save_checkpoint(self):
+        with open(f"{self.checkpoint_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self.checkpoint, f)
+        os.replace(f"{self.checkpoint_path}.tmp", self.checkpoint_path)
+
+    def scan(self):
+        """Returns (added, modified, deleted) file names since the checkpoint.
+
+        Files are only hashed when their mtime or size changed, so an unchanged
+        directory costs one stat per file.
+        """
+        added, modified, current = [], [], set()
+        for file_name in os.listdir(self.directory):
+            file_path = os.path.join(self.directory, file_name)
+            if file_name.startswith(".") or not os.path.isfile(file_path):
+                continue
+            try:
+                stat = os.stat(file_path)
+                entry = self.checkpoint.get(file_name)
+                if entry is None:
+                    added.append(file_name)
+                elif (entry["mtime"], entry["size"]) != (stat.st_mtime, stat.st_size):
+                    if _sha256(file_path) != entry["sha256"]:
+                        modified.append(file_name)
+                    else:
+                        entry.update(mtime=stat.st_mtime, size=stat.st_size)
+            except FileNotFoundError:
+                # Removed since listdir, it shows up as deleted
+                continue
+            current.add(file_name)
+        deleted = [file_name for file_name in self.checkpoint if file_name not in current]
+        return sorted(added), sorted(modified), sorted(deleted)
+
+    def _index(self, jwt_token, file_name):
+        file_path = os.path.join(self.directory, file_name)
+        stat = os.stat(file_path)
+        sha256 = _sha256(file_path)
+        with open(file_path, "rb") as f:
+            duplicate = get_dedup_index().check(
+                file_name, f.read(), "".join(extract_pages(file_path))
+            )
+        entry = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha256}
+        if duplicate is not None and duplicate.name != file_name:
+            logging.info("Skipping %s, %s duplicate of %s", file_name, duplicate.kind, duplicate.name)
+            entry["duplicate_of"] = duplicate.name
+            success = True
+        elif duplicate is not None and duplicate.kind == "exact":
+            # Already indexed under this name, e.g. by the Streamlit uploader
+            logging.info("Skipping %s, already indexed", file_name)
+            success = True
+        else:
+            _, success = index_document(CUSTOMER_ID, CORPUS_ID, IDX_ADDRESS, jwt_token, file_path)
+        if success:
+            self.checkpoint[file_name] = entry
+            self._save_checkpoint()
+        return success
+
+    def _delete(self, jwt_token, file_name):
+        if file_name not in self.checkpoint:
+            # A copy already released along with its original
+            return True
+        if self.checkpoint[file_name].get("duplicate_of"):
+            # Duplicates were never indexed
+            success = True
+        else:
+            _, success = delete_document(CUSTOMER_ID, CORPUS_ID, IDX_ADDRESS, jwt_token, file_name)
+        if success:
+            get_dedup_index().remove(file_name)
+            del self.checkpoint[file_name]
+            self._save_checkpoint()
+        return success
+
+    def _release_copies(self, file_name):
+        """Forgets the copies skipped as duplicates of `file_name` so they are indexed again.
+
+        Returns:
+            The names of the released copies.
+        """
+        copies = sorted(
+            name
+            for name, entry in self.checkpoint.items()
+            if entry.get("duplicate_of") == file_name
+            and os.path.exists(os.path.join(self.directory, name))
+        )
+        for name in copies:
+            get_dedup_index().remove(name)
+            del self.checkpoint[name]
+        if copies:
+            self._save_checkpoint()
+        return copies
+
+    def _try(self, action, jwt_token, file_name):
+        """Runs one file's sync step, logging failures so the file is retried next time."""
+        try:
+            return action(jwt_token, file_name)
+        except Exception as e:
+            logging.error("Failed to sync %s, will retry: %s", file_name, e)
+            return False
+
+    def sync(self):
+        """Pushes the changes since the checkpoint. Returns (added, modified, deleted)."""
+        added, modified, deleted = self.scan()
+        if not (added or modified or deleted):
+            self._save_checkpoint()
+            return added, modified, deleted
+
+        jwt_token = get_jwt_token()
+        if not jwt_token:
+            logging.error("Could not get a JWT token, will retry on the next change")
+            return [], [], []
+        released = []
+        for file_name in deleted:
+            if self._try(self._delete, jwt_token, file_name):
+                released.extend(self._release_copies(file_name))
+        for file_name in modified:
+            # Vectara keeps the old document under the same ID, so replace it
+            if self._try(self._delete, jwt_token, file_name):
+                released.extend(self._release_copies(file_name))
+                self._try(self._index, jwt_token, file_name)
+        # Copies of a removed original are indexed in its place, the first one
+        # indexed becomes the original of the others
+        for file_name in added + sorted(set(released)):
+            self._try(self._index, jwt_token, file_name)
+        logging.info(
+            "Synced %s: %d added, %d modified, %d deleted",
+            self.directory, len(added), len(modified), len(deleted),
+        )
+        return added, modified, deleted
+
+
+def _start_watcher(directory, on_change):
+    """Starts an inotify watcher calling `on_change` on any event, or returns None."""
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        return None
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if not os.path.basename(event.src_path).startswith("."):
+                on_change()
+
+    observer = Observer()
+    observer.schedule(Handler(), directory, recursive=False)
+    observer.start()
+    return observer
+
+
+def run(directory: str, debounce: float = 2.0, poll_interval: float = 30.0, polling: bool = False):
+    """Syncs `directory` forever, debouncing bursts of file events.
+
+    With a watcher, a sync runs once no event arrived for `debounce` seconds, and
+    a full scan still runs every `poll_interval` seconds to catch missed events.
+    Without one, the directory is scanned every `poll_interval` seconds.
+    """
+    corpus_sync = CorpusSync(directory)
+    try:
+        corpus_sync.sync()
+    except Exception as e:
+        logging.error("Initial sync of %s failed, will retry: %s", directory, e)
+
+    changed = threading.Event()
+    last_event = [0.0]
+
+    def on_change():
+        last_event[0] = time.monotonic()
+        changed.set()
+
+    observer = None if polling else _start_watcher(directory, on_change)
+    logging.info("Watching %s with %s", directory, "inotify" if observer else "polling")
+    try:
+        while True:
+            if changed.wait(timeout=poll_interval):
+                # Wait for the burst to settle before syncing
+                while time.monotonic() - last_event[0] < debounce:
+                    time.sleep(debounce - (time.monotonic() - last_event[0]))
+                changed.clear()
+            try:
+                corpus_sync.sync()
+            except Exception as e:
+                logging.error("Sync of %s failed, will retry: %s", directory, e)
+    finally:
+        if observer:
+            observer.stop()
+            observer.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Continuously sync a directory to the corpus")
+    parser.add_argument("directory", nargs="?", default="corpus")
+    parser.add_argument("--debounce", type=float, default=2.0)
+    parser.add_argument("--poll-interval", type=float, default=30.0)
+    parser.add_argument("--polling", action="store_true", help="Do not use inotify")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run(args.directory, args.debounce, args.poll_interval, args.polling)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import pytest
+
+from chunking import patient_from_filename
+
+
+@pytest.mark.parametrize(
+    "filename, patient",
+    [
+        ("Lucas Graham Sunrise Health Medical Center.pdf", "Lucas Graham"),
+        ("corpus/Benjamin Lee Medical Report.pdf", "Benjamin Lee"),
+        ("Drew Carter Sunrise Health Medical Center.pdf", "Drew Carter"),
+        ("Mrinal Sen Medical Report.pdf", "Mrinal Sen"),
+        ("Msimang Ndlovu Medical Report.pdf", "Msimang Ndlovu"),
+        ("Mrs Lee Medical Report.pdf", "Lee"),
+        ("Mr. John Doe Sunrise Health Medical Center.pdf", "John Doe"),
+        ("Dr Jane Roe Medical Report.docx", "Jane Roe"),
+        ("notes.txt", None),
+    ],
+)
+def test_patient_from_filename(filename, patient):
+    assert patient_from_filename(filename) == patient
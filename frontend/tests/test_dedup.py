@@ -0,0 +1,41 @@
+from dedup import DedupIndex, Duplicate
+
+REPORT = (
+    "Patient John Doe was seen for a follow-up visit. Blood pressure was 128/82 mmHg "
+    "and the patient reports improved sleep. Continue current medications and "
+    "review in three months with repeat lab work."
+)
+
+
+def test_failed_indexing_is_not_a_duplicate_on_retry(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite3"))
+    data = REPORT.encode()
+
+    # First attempt: checked, then indexing fails so nothing is added
+    assert index.check("John Doe.pdf", data, REPORT) is None
+    # The retry must not match itself
+    assert index.check("John Doe.pdf", data, REPORT) is None
+
+    index.add("John Doe.pdf", data, REPORT)
+    assert index.check("John Doe.pdf", data, REPORT) == Duplicate("John Doe.pdf", "exact", 1.0)
+
+
+def test_copy_under_another_name_is_linked(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite3"))
+    data = REPORT.encode()
+    index.add("John Doe.pdf", data, REPORT)
+
+    assert index.check("John Doe (1).pdf", data, REPORT) == Duplicate("John Doe.pdf", "exact", 1.0)
+
+
+def test_re_adding_an_original_keeps_its_copies_linked(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite3"))
+    data = REPORT.encode()
+    index.add("John Doe.pdf", data, REPORT)
+    index.add("John Doe (1).pdf", data, REPORT, duplicate_of="John Doe.pdf")
+    # Re-indexing the original must not orphan the copy
+    index.add("John Doe.pdf", data, REPORT)
+
+    index.remove("John Doe.pdf")
+    # The released copy is now the document matching this content
+    assert index.find(data, REPORT) == Duplicate("John Doe (1).pdf", "exact", 1.0)
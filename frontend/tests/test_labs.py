@@ -0,0 +1,88 @@
+import pytest
+
+from labs import LabIndex, answer_numeric_query
+
+
+def _report(directory, patient, blood_pressure, visit_date=None, medications=()):
+    lines = [f"Patient: {patient}"]
+    if visit_date:
+        lines.append(f"Date of Visit: {visit_date}")
+    lines.append(f"Blood Pressure: {blood_pressure} mmHg")
+    if medications:
+        lines.append("Medications Prescribed:")
+        lines.extend(f"• {medication}" for medication in medications)
+    path = directory / f"{patient} Medical Report.txt"
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LabIndex(str(tmp_path / "labs.sqlite3"))
+    index.index_report(_report(tmp_path, "Ann Park", "170/70", "March 3, 2024", ["Lisinopril 10 mg"]))
+    index.index_report(_report(tmp_path, "Bob Stone", "120/105", "March 5, 2024"))
+    index.index_report(_report(tmp_path, "Lee", "118/76"))
+    return index
+
+
+def test_highest_blood_pressure_is_one_patients_reading(index):
+    answer = answer_numeric_query("highest blood pressure", index)
+    assert answer == "Highest blood pressure across 3 patients: 170/70 mmHg (Ann Park, 2024-03-03)"
+
+
+def test_lowest_blood_pressure_names_the_patient(index):
+    answer = answer_numeric_query("lowest blood pressure", index)
+    assert answer == "Lowest blood pressure across 3 patients: 118/76 mmHg (Lee, no visit date recorded)"
+
+
+def test_average_blood_pressure(index):
+    answer = answer_numeric_query("average blood pressure", index)
+    assert answer == "Average blood pressure across 3 patients: 136/83.7 mmHg"
+
+
+def test_latest_value_for_patient(index):
+    answer = answer_numeric_query("What is the latest blood pressure for Ann Park?", index)
+    assert answer == "Latest blood pressure for Ann Park: 170/70 mmHg (2024-03-03)"
+
+
+def test_single_name_patient_needs_a_whole_word(index):
+    query = "what is the latest blood pressure for patients with sleep apnea"
+    assert "Lee" not in (answer_numeric_query(query, index) or "")
+    assert answer_numeric_query("latest blood pressure for Lee", index).startswith(
+        "Latest blood pressure for Lee: 118/76 mmHg"
+    )
+
+
+def test_threshold_filter(index):
+    answer = answer_numeric_query("which patients have blood pressure above 140/90", index)
+    assert answer.splitlines() == [
+        "Patients with blood pressure above 140/90:",
+        "- Ann Park: 170/70 mmHg (2024-03-03)",
+        "- Bob Stone: 120/105 mmHg (2024-03-05)",
+    ]
+
+
+def test_medications(index):
+    answer = answer_numeric_query("medications for Ann Park", index)
+    assert answer == "Medications for Ann Park:\n- Lisinopril 10 mg (2024-03-03)"
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "What is causing Ann Park's high blood pressure and how should it be treated?",
+        "Summarize the visit notes",
+    ],
+)
+def test_non_numeric_questions_fall_back_to_search(index, query):
+    assert answer_numeric_query(query, index) is None
+
+
+def test_report_indexed_from_a_blob_uses_its_upload_name(tmp_path):
+    index = LabIndex(str(tmp_path / "labs.sqlite3"))
+    blob = tmp_path / "0f3a9c.txt"
+    blob.write_text("Patient: Ann Park\nBlood Pressure: 150/95 mmHg\n")
+    assert index.index_report(str(blob), filename="Ann Park Medical Report.txt") == 1
+
+    answer = answer_numeric_query("latest blood pressure for Ann Park", index)
+    assert answer.startswith("Latest blood pressure for Ann Park: 150/95 mmHg")